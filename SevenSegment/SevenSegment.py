@@ -1,17 +1,508 @@
 # SevenSegment.py
 # Produces a visual representation of a seven-segment display which the user
 # can control.
-
-# Import Tkinter to do the graphics and the time package for the demo mode.
-try:
-    import Tkinter
-except:
-    import tkinter as Tkinter
+#
+# The display can be drawn in two ways (backends):
+#
+#   "tk"     - in a window on screen, using Tkinter (the default).
+#   "raster" - as images in memory, using NumPy, without needing a screen at
+#              all.  Handy for tests, or for making pictures and animations
+#              of the display (see SevenSegmentRaster.py).
+#
+# Tkinter is only imported when the Tk backend is used.
+#
+# Animations such as scroll() are run by a scheduler rather than by sleeping
+# between frames, so the window keeps working while they play, several can
+# play at once, and each returns an Animation which can be paused, resumed,
+# cancelled or waited for.
+
+import array
+import heapq
+import itertools
+import math
 import time
 
+# The polygon for each segment, as a list of x,y pairs where the coordinates
+# assume a cell 100 pixels wide and 147 high.  The segments are scaled
+# appropriately based on the actual width and height of a cell.
+SEG_COORDS = [
+    [(17, 0), (65, 0), (73, 8), (65, 16), (17, 16), (9, 8)],
+    [(74, 9), (82, 17), (82, 65), (74, 73), (66, 65), (66, 17)],
+    [(74, 74), (82, 82), (82, 130), (74, 138), (66, 130), (66, 82)],
+    [(17, 131), (65, 131), (73, 139), (65, 147), (17, 147), (9, 139)],
+    [(8, 74), (16, 82), (16, 130), (8, 138), (0, 130), (0, 82)],
+    [(8, 9), (16, 17), (16, 65), (8, 73), (0, 65), (0, 17)],
+    [(17, 66), (65, 66), (73, 74), (65, 82), (17, 82), (9, 74)],
+    [(83, 139), (91, 131), (99, 139), (91, 147)]]
+
+
+# The segments each bit of a cell's bitflags lights up:
+#
+#      --0--
+#     |     |
+#     5     1
+#     |     |
+#      --6--
+#     |     |
+#     4     2
+#     |     |
+#      --3--  .7
+#
+DECIMAL_POINT = 0b10000000
+
+# The bitflags to show each character.  Letters that can't be drawn well in
+# seven segments use the nearest recognisable shape, and some are only
+# possible in lower case (e.g. "b", "d", "n").  Characters without an entry
+# of their own use their upper-case letter's.
+GLYPHS = {
+    "0": 0b00111111, "1": 0b00000110, "2": 0b01011011, "3": 0b01001111,
+    "4": 0b01100110, "5": 0b01101101, "6": 0b01111101, "7": 0b00000111,
+    "8": 0b01111111, "9": 0b01101111,
+    "A": 0b01110111, "B": 0b01111100, "C": 0b00111001, "D": 0b01011110,
+    "E": 0b01111001, "F": 0b01110001, "G": 0b00111101, "H": 0b01110110,
+    "I": 0b00000110, "J": 0b00011110, "K": 0b01110101, "L": 0b00111000,
+    "M": 0b00110111, "N": 0b01010100, "O": 0b00111111, "P": 0b01110011,
+    "Q": 0b01100111, "R": 0b01010000, "S": 0b01101101, "T": 0b01111000,
+    "U": 0b00111110, "V": 0b00111110, "W": 0b00101010, "X": 0b01110110,
+    "Y": 0b01101110, "Z": 0b01011011,
+    "b": 0b01111100, "c": 0b01011000, "d": 0b01011110, "h": 0b01110100,
+    "i": 0b00000100, "n": 0b01010100, "o": 0b01011100, "r": 0b01010000,
+    "t": 0b01111000, "u": 0b00011100,
+    " ": 0, "-": 0b01000000, "_": 0b00001000, "=": 0b01001000,
+    "'": 0b00100000, '"': 0b00100010, "(": 0b00111001, ")": 0b00001111,
+    "[": 0b00111001, "]": 0b00001111, "?": 0b01010011, "/": 0b01010010,
+    "\\": 0b01100100, "|": 0b00110000, "°": 0b01100011,
+    ".": DECIMAL_POINT, ",": DECIMAL_POINT,
+}
+
+
+# Turn text into the bitflags to show it, one byte per cell.  A "." or ","
+# after a character lights that character's decimal point rather than
+# taking up a cell of its own.  Characters with no glyph are left blank.
+def encode_text(text):
+    codes = bytearray()
+    for char in text:
+        if char in ".," and codes and not codes[-1] & DECIMAL_POINT:
+            codes[-1] |= DECIMAL_POINT
+            continue
+        glyph = GLYPHS.get(char)
+        if glyph is None:
+            glyph = GLYPHS.get(char.upper(), 0)
+        codes.append(glyph)
+    return bytes(codes)
+
+
+# How many cells text takes up, a decimal point sharing its digit's cell.
+def _cells(text):
+    return len(text) - text.count(".")
+
+
+# Drop the zeros from the end of a number's decimal places, and its point if
+# no decimal places are left.
+def _trim(text):
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text
+
+
+# Format a float to fit in width cells, rounded to as many decimal places as
+# there's room for, without any zeros on the end: e.g. 0.1 + 0.2 is "0.3".
+# Numbers too big (or too small) to show like that are shown like "1.5E20"
+# (or "2E-9"), tiny ones which won't fit even then as "0", and anything else
+# which won't fit as dashes.
+def format_number(number, width):
+    if not math.isfinite(number):
+        text = "%f" % number
+        return text if len(text) <= width else "-" * width
+
+    for decimals in range(width - 1, -1, -1):
+        text = _trim("%.*f" % (decimals, number))
+        if text == "-0":
+            text = "0"
+        # Rounding away every significant digit isn't a good fit.
+        if _cells(text) <= width and (float(text) or not number):
+            return text
+
+    for precision in range(width - 1, -1, -1):
+        mantissa, exponent = ("%.*e" % (precision, number)).split("e")
+        text = "%sE%d" % (_trim(mantissa), int(exponent))
+        if _cells(text) <= width:
+            return text
+
+    return "0" if abs(number) < 1 else "-" * width
+
+
+# The frames for scrolling a message across a display, compiled once.  The
+# message is kept as one run of bytes with a display's width of blanks at
+# each end, and each frame is just a window onto it, so a long ticker takes
+# no more memory than its message and nothing needs working out as it
+# plays.
+class ScrollFrames():
+
+    def __init__(self, codes, width):
+        self.width = width
+        self.data = bytes(width) + bytes(codes) + bytes(width)
+
+    def __len__(self):
+        return len(self.data) - self.width + 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.data[index:index + self.width]
+
+
+# Scale a segment's polygon to a cell of the given size at the given
+# position, giving a flat list of absolute coordinates x1, y1, x2, y2...
+def scale_coords(coordinates, x_pos, y_pos, width, height):
+    coords = []
+    for (x, y) in coordinates:
+        coords.append(x_pos + ((width * x) / 100))
+        coords.append(y_pos + ((height * y) / 147))
+    return coords
+
+
+# Runs timed callbacks, such as the frames of an animation, for displays
+# which don't have a window to do it for them (e.g. the raster backend).
+# Several displays can share one scheduler, so that all their animations are
+# run from the same loop.
+class Scheduler():
+
+    # If realtime is False, the scheduler doesn't wait for each deadline - it
+    # just moves its clock on - so animations are drawn as fast as possible
+    # (e.g. to save them as a video).
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        # How far the clock has been moved on.
+        self.offset = 0.0
+        # (deadline, token, callback), soonest first.
+        self.pending = []
+        self.tokens = itertools.count()
+        self.cancelled = set()
+
+    def now(self):
+        return time.monotonic() + self.offset
+
+    # Call callback at the given time (on the now() clock).  Returns a token
+    # for cancel().
+    def call_at(self, deadline, callback):
+        token = next(self.tokens)
+        heapq.heappush(self.pending, (deadline, token, callback))
+        return token
+
+    def cancel(self, token):
+        self.cancelled.add(token)
+
+    # Run callbacks as they fall due, until there are none left or until()
+    # returns True.
+    def run(self, until=None):
+        while self.pending and not (until is not None and until()):
+            deadline, token, callback = self.pending[0]
+            if token in self.cancelled:
+                heapq.heappop(self.pending)
+                self.cancelled.discard(token)
+                continue
+            wait = deadline - self.now()
+            if wait > 0:
+                if self.realtime:
+                    time.sleep(wait)
+                    continue
+                self.offset += wait
+            heapq.heappop(self.pending)
+            callback()
+
+    def wait_for(self, animation):
+        self.run(until=lambda: animation.finished)
+
+
+# Runs timed callbacks using a Tk window's after(), so that they happen
+# while the window carries on working as normal.
+class TkScheduler():
+
+    def __init__(self, root, Tkinter):
+        self.root = root
+        self.Tkinter = Tkinter
+        # Whether we're in the middle of running a callback.
+        self.busy = False
+
+    def now(self):
+        return time.monotonic()
+
+    def call_at(self, deadline, callback):
+        delay = max(0, int(round((deadline - self.now()) * 1000)))
+        return self.root.after(delay, self._run, callback)
+
+    def _run(self, callback):
+        self.busy = True
+        try:
+            callback()
+        finally:
+            self.busy = False
+
+    def cancel(self, token):
+        self.root.after_cancel(token)
+
+    # Keep the window (and any others) working until the animation has
+    # finished.
+    def wait_for(self, animation):
+        done = self.Tkinter.BooleanVar(master=self.root, value=False)
+        animation.add_done_callback(lambda: done.set(True))
+        if not animation.finished:
+            self.root.wait_variable(done)
+
+
+# Plays a sequence of frames on a display, each frame delay seconds after
+# the one before.  The frames are timed from when the animation started, so
+# a slow redraw doesn't make the whole thing run late; if drawing falls
+# behind, frames are skipped (and counted in dropped) to catch up.
+class Animation():
+
+    # Parms:
+    #     display   - the display to play the animation on.
+    #     frames    - a list of frames, each a list of values for set() or
+    #                 bytes (see show_frame()).  Anything that can be
+    #                 indexed will do, such as ScrollFrames.
+    #     delay     - seconds between frames.  With 0 (or less), every
+    #                 frame is shown, one each time the scheduler gets to it.
+    #     scheduler - what to run it with (the display's, by default).
+    #     loop      - start again at the beginning after the last frame.
+    def __init__(self, display, frames, delay=0.5, scheduler=None,
+                 loop=False):
+        self.display = display
+        self.frames = frames
+        self.delay = delay
+        self.scheduler = scheduler or display.scheduler
+        self.loop = loop
+        self.shown = 0
+        self.dropped = 0
+        self.finished = False
+        self.cancelled = False
+        self.paused_at = None
+        self.token = None
+        self.done_callbacks = []
+        self.next_frame = 0
+        self.start = self.scheduler.now()
+        self._schedule()
+
+    def _schedule(self):
+        self.token = self.scheduler.call_at(
+            self.start + self.next_frame * self.delay, self._tick)
+
+    def _tick(self):
+        self.token = None
+        count = len(self.frames)
+        if self.next_frame >= count:
+            # The last frame has been shown for its time.
+            if not self.loop or count == 0:
+                self._finish()
+                return
+            self.start += count * self.delay
+            self.next_frame = 0
+
+        # Show whichever frame is due now, skipping any we're too late for.
+        # (Without a delay, no frame is ever late.)
+        index = self.next_frame
+        if self.delay > 0:
+            due = int((self.scheduler.now() - self.start) / self.delay)
+            index = max(index, min(due, count - 1))
+        self.dropped += index - self.next_frame
+        if self.display.stats is not None:
+            self.display.stats.dropped += index - self.next_frame
+        self.display.show_frame(self.frames[index])
+        self.shown += 1
+        self.next_frame = index + 1
+        self._schedule()
+
+    def pause(self):
+        if self.finished or self.paused_at is not None:
+            return
+        self.paused_at = self.scheduler.now()
+        if self.token is not None:
+            self.scheduler.cancel(self.token)
+            self.token = None
+
+    def resume(self):
+        if self.paused_at is None:
+            return
+        self.start += self.scheduler.now() - self.paused_at
+        self.paused_at = None
+        self._schedule()
+
+    def cancel(self):
+        if self.finished:
+            return
+        if self.token is not None:
+            self.scheduler.cancel(self.token)
+            self.token = None
+        self.cancelled = True
+        self._finish()
+
+    # Wait until the animation has finished, keeping the display (and any
+    # other animations) going in the meantime.
+    def wait(self):
+        self.scheduler.wait_for(self)
+
+    # Call callback() once the animation has finished.
+    def add_done_callback(self, callback):
+        if self.finished:
+            callback()
+        else:
+            self.done_callbacks.append(callback)
+
+    def _finish(self):
+        self.finished = True
+        callbacks = self.done_callbacks
+        self.done_callbacks = []
+        for callback in callbacks:
+            callback()
+
+
+# A segment's shape within a cell: the bit it responds to and its polygon,
+# relative to the cell's top-left corner.  Every cell of the same size
+# shares the same segments, so a display with thousands of cells only has
+# eight of these.
+class Segment():
+
+    __slots__ = ("flag_value", "coords")
+
+    def __init__(self, flag_value, coords):
+        self.flag_value = flag_value
+        self.coords = coords
+
+    # The polygon's coordinates for a cell with its top-left corner at
+    # x_pos, y_pos.
+    def place(self, x_pos, y_pos):
+        coords = list(self.coords)
+        coords[0::2] = [x + x_pos for x in coords[0::2]]
+        coords[1::2] = [y + y_pos for y in coords[1::2]]
+        return coords
+
+
+_segments = {}
+
+
+# The segments for a cell of the given size, worked out once per size.
+def cell_segments(width, height):
+    key = (width, height)
+    if key not in _segments:
+        _segments[key] = tuple(
+            Segment(2 ** ii, tuple(scale_coords(coords, 0, 0, width, height)))
+            for ii, coords in enumerate(SEG_COORDS))
+    return _segments[key]
+
+
+# Draws a Display in a window using Tkinter.
+class TkBackend():
+
+    def __init__(self, display):
+        try:
+            import Tkinter
+        except ImportError:
+            import tkinter as Tkinter
+        self.root = Tkinter.Tk()
+        self.root.title("Seven Segment Display")
+        self.scheduler = TkScheduler(self.root, Tkinter)
+        self.canvas = Tkinter.Canvas(self.root,
+                                     width=display.width,
+                                     height=display.height,
+                                     borderwidth=0,
+                                     highlightthickness=0,
+                                     background=display.bgcolor)
+        self.canvas.pack()
+        self.on_color = display.oncolor
+        self.off_color = display.offcolor
+
+        # Create every segment's polygon once, keeping their ids: eight to
+        # a cell, in cell order.
+        self.items = array.array("l")
+        segments = cell_segments(display.cell_width, display.cell_height)
+        for index in range(len(display.flags)):
+            x_pos, y_pos = display.cell_position(index)
+            for segment in segments:
+                self.items.append(self.canvas.create_polygon(
+                    segment.place(x_pos, y_pos),
+                    outline=display.linecolor,
+                    fill=self.off_color))
+        # The bitflags of each cell as they were last drawn.
+        self.drawn = bytearray(len(display.flags))
+
+    def draw(self, flags):
+        # Bring each cell up to date - only segments which have changed are
+        # touched - and then update the window once for all of them.
+        if flags != self.drawn:
+            itemconfig = self.canvas.itemconfig
+            items = self.items
+            for index, (new, old) in enumerate(zip(flags, self.drawn)):
+                changed = new ^ old
+                if not changed:
+                    continue
+                for bit in range(8):
+                    if changed & (1 << bit):
+                        if new & (1 << bit):
+                            color = self.on_color
+                        else:
+                            color = self.off_color
+                        itemconfig(items[index * 8 + bit], fill=color)
+            self.drawn[:] = flags
+        if self.scheduler.busy:
+            # We're already inside Tk's event loop, which will draw the
+            # window when we return.
+            self.root.update_idletasks()
+        else:
+            self.root.update()
+
+
+# How many recent redraw times FrameStats keeps for working out percentiles.
+REDRAW_SAMPLES = 10000
+
+
+# Counts the frames a display draws, and times how long each redraw takes,
+# to see what a display of a given size costs and to catch anything that
+# makes drawing slower.  Turned on with Display(..., stats=True).
+class FrameStats():
+
+    def __init__(self):
+        # Frames drawn, and frames of animations skipped to catch up.
+        self.rendered = 0
+        self.dropped = 0
+        self.total_time = 0.0
+        self.redraw_times = []
+        self.redraw_pos = 0
+
+    def record(self, seconds):
+        self.rendered += 1
+        self.total_time += seconds
+        if len(self.redraw_times) < REDRAW_SAMPLES:
+            self.redraw_times.append(seconds)
+        else:
+            self.redraw_times[self.redraw_pos] = seconds
+            self.redraw_pos = (self.redraw_pos + 1) % REDRAW_SAMPLES
+
+    # Get a summary of the frames so far.  Redraw times are in seconds.
+    def snapshot(self):
+        times = sorted(self.redraw_times)
+
+        def percentile(pct):
+            if not times:
+                return 0.0
+            return times[min(len(times) - 1, int(len(times) * pct / 100))]
+
+        return {
+            "rendered": self.rendered,
+            "dropped": self.dropped,
+            "redraw_mean": self.total_time / self.rendered
+                           if self.rendered else 0.0,
+            "redraw_p50": percentile(50),
+            "redraw_p90": percentile(90),
+            "redraw_p99": percentile(99),
+            "redraw_max": times[-1] if times else 0.0,
+        }
+
 
 # Display - a seven-segment display
-class Display(Tkinter.Tk):
+class Display():
 
     # Set up some colours to use for background, segment outlines and
     # segment colours when they're on and off.
@@ -24,188 +515,135 @@ class Display(Tkinter.Tk):
     cell_width = 100
     cell_height = 150
     border = 5
-    max_cells = 10
 
-    # Class representing a single cell in a 7-segment display.
+    # Class representing a single cell in a 7-segment display.  The cell's
+    # bitflags are kept in the display's flags array, along with all the
+    # other cells', so this is just a way of getting at them.
     class Cell():
 
-        class Segment():
-
-            ON = 1
-            OFF = 0
-
-            # Constructor.
-            # Parms:
-            #     flag_value  - the bit(s) that this segment responds to.
-            #     x_pos       - the x-position of the top-left corner of the
-            #                   space where this segment exists on a canvas.
-            #     y_pos       - the y-position of the top-left corner of the
-            #                   space where this segment exists on a canvas.
-            #     width       - the width of the canvas where this segment can
-            #                   be drawn.
-            #     height      - the height of the canvas where this segment can
-            #                   be drawn.
-            #     coordinates - a list of (x,y) tuples giving coordinates of a
-            #                   polygon (expressed as % of width and height)
-            #                   where the segment is drawn.
-            #     line_color  - the line colour to use when drawing.
-            #     on_colour   - the colour to use when the segment is active.
-            #     off_colour  - the colour to use when the segment in inactive.
-            def __init__(self, flag_value, x_pos, y_pos, width, height,
-                         coordinates, line_color, on_color, off_color):
-
-                # Save off the colours to use.
-                self.line_color = line_color
-                self.on_color = on_color
-                self.off_color = off_color
-
-                # Save the value this segment is responsive to.
-                self.flag_value = flag_value
-
-                # Convert raw coordinate tuples to a list of absolute
-                # coordinates.
-                self.coords = []
-                for coord in coordinates:
-                    (x, y) = coord
-                    x = x_pos + ((width * x) / 100)
-                    y = y_pos + ((height * y) / 147)
-                    self.coords.append(x)
-                    self.coords.append(y)
-
-                self.set_state(self.OFF)
-
-            # Set the state of the segment and update the colour accordingly.
-            def set_state(self, new_state):
-                self.state = new_state
-                if self.state == self.ON:
-                    self.color = self.on_color
-                else:
-                    self.color = self.off_color
-
-            # Draw the segment on a canvas.
-            def draw(self, canvas):
-                canvas.create_polygon(self.coords,
-                                      outline=self.line_color,
-                                      fill=self.color)
-
-        # END class Segment
-
-        def __init__(self, x_pos, y_pos, width, height,
-                     line_color, on_color, off_color):
-            self.bitflags = 0
-
-            # Create the cell's segments, giving them each coordinates for
-            # their polygons as a list of x,y pairs where the coordinate assume
-            # a cell 100 pixels wide and 150 high.  The segments will scale
-            # appropriately based on the actual width and height.
-            seg_coords = [
-                [(17, 0), (65, 0), (73, 8), (65, 16), (17, 16), (9, 8)],
-                [(74, 9), (82, 17), (82, 65), (74, 73), (66, 65), (66, 17)],
-                [(74, 74), (82, 82), (82, 130), (74, 138), (66, 130),
-                 (66, 82)],
-                [(17, 131), (65, 131), (73, 139), (65, 147), (17, 147),
-                 (9, 139)],
-                [(8, 74), (16, 82), (16, 130), (8, 138), (0, 130), (0, 82)],
-                [(8, 9), (16, 17), (16, 65), (8, 73), (0, 65), (0, 17)],
-                [(17, 66), (65, 66), (73, 74), (65, 82), (17, 82), (9, 74)],
-                [(83, 139), (91, 131), (99, 139), (91, 147)]]
-            self.segments = []
-            for ii in range(len(seg_coords)):
-                self.segments.append(self.Segment(2**ii,
-                                                  x_pos,
-                                                  y_pos,
-                                                  width,
-                                                  height,
-                                                  seg_coords[ii],
-                                                  line_color,
-                                                  on_color,
-                                                  off_color))
+        __slots__ = ("flags", "index")
 
-        def set(self, bitflags=0):
-            self.bitflags = bitflags
+        def __init__(self, flags, index):
+            self.flags = flags
+            self.index = index
 
-            # Loop through the cell's segments, setting them on or off based
-            # on the bitflags.
-            for segment in self.segments:
-                if bitflags & segment.flag_value:
-                    segment.set_state(segment.ON)
-                else:
-                    segment.set_state(segment.OFF)
+        @property
+        def bitflags(self):
+            return self.flags[self.index]
 
-        def draw(self, canvas):
-            # Loop through the segments, adding each one to the canvas.
-            for segment in self.segments:
-                segment.draw(canvas)
+        def set(self, bitflags=0):
+            self.flags[self.index] = bitflags & 0xFF
 
         # END class Cell
 
-    def __init__(self, num_cells=1):
+    # Parms:
+    #     num_cells - how many digits the display has (in each row).
+    #     backend   - "tk" to draw in a window, "raster" to draw images in
+    #                 memory, or a backend class of your own (called with the
+    #                 display, and given the display's flags to draw by
+    #                 draw(flags)).
+    #     rows      - how many rows of digits the display has.
+    #     stats     - count frames and time each redraw, in self.stats (see
+    #                 FrameStats).
+    def __init__(self, num_cells=1, backend="tk", rows=1, stats=False):
         # Initialization just creates a blank display.
-        Tkinter.Tk.__init__(self)
-        self.title("Seven Segment Display")
-
-        num_cells = min(num_cells, self.max_cells)
-        num_cells = max(num_cells, 1)
-        self.canvas = Tkinter.Canvas(self,
-                                     width=(self.cell_width*num_cells +
-                                     2 * self.border),
-                                     height=(self.cell_height +
-                                     2 * self.border),
-                                     borderwidth=0,
-                                     highlightthickness=0,
-                                     background=self.bgcolor)
-
-        # Create a line of cells with a border above and to the left.
-        self.cells = []
-        for ii in range(num_cells):
-            new_cell = self.Cell(self.border + ii * self.cell_width,
-                                 self.border,
-                                 self.cell_width,
-                                 self.cell_height,
-                                 self.linecolor,
-                                 self.oncolor,
-                                 self.offcolor)
-            self.cells.append(new_cell)
-
+        self.columns = max(num_cells, 1)
+        self.rows = max(rows, 1)
+        self.width = self.cell_width * self.columns + 2 * self.border
+        self.height = self.cell_height * self.rows + 2 * self.border
+
+        # Every cell's bitflags, a byte each, row by row.
+        self.flags = bytearray(self.columns * self.rows)
+        self.cells = [self.Cell(self.flags, ii)
+                      for ii in range(len(self.flags))]
+        self.segments = cell_segments(self.cell_width, self.cell_height)
+        self.stats = FrameStats() if stats else None
+
+        if backend == "tk":
+            backend = TkBackend
+        elif backend == "raster":
+            from SevenSegmentRaster import RasterBackend
+            backend = RasterBackend
+        self.backend = backend(self)
+        self.scheduler = getattr(self.backend, "scheduler", None)
+        if self.scheduler is None:
+            self.scheduler = Scheduler()
         self.redraw()
 
+    # Anything we don't know about is passed on to the backend, and from
+    # there to its window, so that the display can still be used like the Tk
+    # window it used to be, e.g. disp.mainloop() or disp.canvas.
+    def __getattr__(self, name):
+        backend = self.__dict__.get("backend")
+        if backend is None:
+            raise AttributeError(name)
+        if hasattr(backend, name):
+            return getattr(backend, name)
+        root = getattr(backend, "root", None)
+        if root is None:
+            raise AttributeError(name)
+        return getattr(root, name)
+
+    # Where the top-left corner of a cell is, with a border above and to the
+    # left of the cells.
+    def cell_position(self, index):
+        row, column = divmod(index, self.columns)
+        return (self.border + column * self.cell_width,
+                self.border + row * self.cell_height)
+
     def redraw(self):
-        # Clear the canvas and redraw each cell.
-        self.canvas.delete("all")
-        for cell in self.cells:
-            cell.draw(self.canvas)
-        self.canvas.pack()
-        self.update()
+        if self.stats is None:
+            self.backend.draw(self.flags)
+            return
+        start = time.perf_counter()
+        self.backend.draw(self.flags)
+        self.stats.record(time.perf_counter() - start)
 
     # set()
     # Sets which segments of the display are lit.
     # Params: Variable number of integers indicating what each cell should
-    #         display.
+    #         display.  On a display with more than one row, the cells are
+    #         filled in row by row.
     # Examples: set(0)
     #           set(0b00000110, 0b01011011)
     def set(self, *args):
-        arglist = list(args)
-
-        # Before setting new values, clear the existing values for each
-        # cell.
-        for cell in self.cells:
-            cell.set(0)
-
-        # Make sure we set the right-most cells in the display.
-        num_cells_to_set = min(len(self.cells), len(arglist))
-        cells_to_set = self.cells[num_cells_to_set * -1:]
-
-        # Now set the cells according to the passed in arguments
-        for cell, value in zip(cells_to_set, arglist):
-            cell.set(value)
+        # Make sure we set the right-most cells in the display, and clear
+        # the rest.
+        values = args[-len(self.flags):]
+        blanks = len(self.flags) - len(values)
+        self.flags[:blanks] = bytes(blanks)
+        self.flags[blanks:] = bytes(value & 0xFF for value in values)
         self.redraw()
 
+    # show_frame()
+    # Show a frame of an animation: the values for every cell, as bytes
+    # (e.g. from encode_text() or ScrollFrames) or a list.  A frame of the
+    # right size is copied straight into the display.
+    def show_frame(self, frame):
+        if len(frame) == len(self.flags) and isinstance(frame, bytes):
+            self.flags[:] = frame
+            self.redraw()
+        else:
+            self.set(*frame)
+
+    # animate()
+    # Play a list of frames on the display, one every delay seconds.  Returns
+    # straight away with an Animation which can be paused, resumed,
+    # cancelled or waited for.
+    # Params: frames - List of frames, each a list of values for set().
+    #         delay  - The delay, in seconds, between frames.
+    #         loop   - Whether to keep playing the frames over and over.
+    def animate(self, frames, delay=0.5, loop=False):
+        return Animation(self, frames, delay, self.scheduler, loop)
+
     # scroll()
     # Scroll a sequence across the display from right to left.
     # Params: sequence - List of integers which make up the "message" to scroll
     #                    across the display.
     #         delay    - The delay, in seconds, between movements.
-    def scroll(self, sequence, delay=0.5):
+    #         wait     - Whether to wait for the scrolling to finish.  If not,
+    #                    returns straight away (see animate()).
+    def scroll(self, sequence, delay=0.5, wait=True):
         # Put a load of 'blank' entries at either end of the passed in
         # sequence so that we get something like this.
         #
@@ -216,52 +654,50 @@ class Display(Tkinter.Tk):
         # The number of blanks we need at either end needs to match the
         # size of the display so that scrolling starts and finishes with a
         # blank display.
-        blanks = []
-        for ii in range(len(self.cells)):
-            blanks.append(0)
-        sequence.extend(blanks)
-        sequence[:0] = blanks
-
-        # Now display the message one chunk at a time.
-        for ii in range(1 + len(sequence) - len(self.cells)):
-            self.set(*sequence[ii:ii+len(self.cells)])
-            time.sleep(delay)
-
-    # A cheater's way to make a display show a number.  If the display isn't
-    # big enough then it will only show the lowest-order digits.
-    def show_number(self, number):
-        # Have a helper array of the bit-patterns for each digit.
-        numbers = [0b00111111,  # 0
-                   0b00000110,  # 1
-                   0b01011011,  # 2
-                   0b01001111,  # 3
-                   0b01100110,  # 4
-                   0b01101101,  # 5
-                   0b01111101,  # 6
-                   0b00000111,  # 7
-                   0b01111111,  # 8
-                   0b01101111]  # 9
-
-        # Start by blanking all cells except the last, which is a zero.
-        for ii in range(len(self.cells)):
-            self.cells[ii].set(0)
-        self.cells[len(self.cells)-1].set(numbers[0])
-
-        number = int(number)
-        dig_pos = len(self.cells)
-        values_to_set = []
-        while number > 0 and dig_pos > 0:
-            dig_pos = dig_pos - 1
-            self.cells[dig_pos].set(numbers[number % 10])
-            number = number / 10
-        self.redraw()
+        # The frames are worked out once, as windows onto the message (see
+        # ScrollFrames).
+        frames = ScrollFrames(bytes(value & 0xFF for value in sequence),
+                              len(self.flags))
+        animation = self.animate(frames, delay)
+        if wait:
+            animation.wait()
+        return animation
+
+    # scroll_text()
+    # Scroll some text across the display from right to left.
+    # Params: as for scroll(), but with the text to show.
+    def scroll_text(self, text, delay=0.5, wait=True):
+        return self.scroll(encode_text(text), delay, wait)
+
+    # show_text()
+    # Show some text at the right-hand end of the display.  If the display
+    # isn't big enough then only the end of the text is shown.
+    def show_text(self, text):
+        self.set(*encode_text(text))
+
+    # show_number()
+    # Show a number at the right-hand end of the display.  If the display
+    # isn't big enough for an integer then it will only show the
+    # lowest-order digits.
+    # Params: number   - the number to show (an integer or a float).
+    #         decimals - how many digits to show after the decimal point.  By
+    #                    default integers are shown without a decimal point,
+    #                    and floats rounded to fit the display (see
+    #                    format_number()).
+    def show_number(self, number, decimals=None):
+        if decimals is not None:
+            text = "%.*f" % (decimals, number)
+        elif isinstance(number, float):
+            text = format_number(number, len(self.flags))
+        else:
+            text = "%d" % number
+        self.show_text(text)
 
     # demo()
     # Do a demo of the display, Showing the word "HELLO" scrolling on and off
     # Params: none.
     def demo(self):
-        self.scroll(sequence=[0b01110110, 0b01111001, 0b00111000,
-                              0b00111000, 0b00111111], delay=0.2)
+        self.scroll_text("HELLO", delay=0.2)
 
 
 def main():
@@ -0,0 +1,187 @@
+# SevenSegmentBench.py
+# Measure what seven-segment displays cost to create and draw, for displays
+# of different sizes and each backend, to help size big wall displays and
+# to spot changes that make drawing slower.
+#
+# For each backend, it measures:
+#
+#   - startup: how long a fresh Python takes to import the module and to
+#     show its first display
+#
+# and for each number of cells:
+#
+#   - construction: how long Display() takes
+#   - updates: how long set(), show_number() and show_frame() take, with the
+#     redraw time percentiles from the display's FrameStats
+#   - scrolling: how many frames a second a scrolling message plays at, with
+#     the scheduler's clock moved on rather than waited for
+#   - rendering: for the raster backend, which only makes pictures when
+#     asked for them, how many frames a second render() turns into pictures
+#
+# Backends that can't run here (e.g. Tk without a screen) are skipped.
+#
+# Usage:
+#
+#   python SevenSegmentBench.py [--cells 1 8 64 512] [--backends raster tk]
+#                               [--frames N]
+import argparse
+import os
+import subprocess
+import sys
+import time
+from SevenSegment import (Animation, Display, FrameStats, Scheduler,
+                          ScrollFrames, encode_text)
+
+# Cells in a row; bigger displays get more rows.
+ROW_LENGTH = 32
+
+# Most memory to use for pictures at once when timing render().
+RENDER_BATCH_BYTES = 64 * 1024 * 1024
+
+# What to import, and how to make a display, to time each backend starting
+# up in a fresh Python.
+STARTUP = {
+    "tk": ("import SevenSegment", "SevenSegment.Display(1)"),
+    "raster": ("import SevenSegment, SevenSegmentRaster",
+               "SevenSegment.Display(1, backend='raster')"),
+}
+
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+%s
+imported = time.perf_counter()
+%s
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+# Time how long a fresh Python takes to import a backend and show its first
+# display.  Returns (import seconds, display seconds).
+def time_startup(backend):
+    imports, make_display = STARTUP[backend]
+    output = subprocess.check_output(
+        [sys.executable, "-c", STARTUP_SCRIPT % (imports, make_display)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.DEVNULL)
+    imported, displayed = output.split()
+    return float(imported), float(displayed)
+
+
+def make_display(backend, cells):
+    columns = min(cells, ROW_LENGTH)
+    rows = (cells + columns - 1) // columns
+    return Display(columns, backend=backend, rows=rows, stats=True)
+
+
+# Call update(ii) for each of count frames, returning the mean seconds per
+# call and the display's redraw times.
+def time_updates(display, update, count):
+    display.stats = FrameStats()
+    start = time.perf_counter()
+    for ii in range(count):
+        update(ii)
+    elapsed = time.perf_counter() - start
+    return elapsed / count, display.stats.snapshot()
+
+
+def scroll_frames(display, count):
+    message = encode_text("0123456789 ABCDEF " * (count // 18 + 1))
+    return ScrollFrames(message[:count], len(display.flags))
+
+
+# Play a scrolling message across the display as fast as it can be drawn.
+# Returns frames per second.
+def time_scroll(display, count):
+    frames = scroll_frames(display, count)
+    scheduler = Scheduler(realtime=False)
+    start = time.perf_counter()
+    animation = Animation(display, frames, delay=0.05, scheduler=scheduler)
+    animation.wait()
+    return animation.shown / (time.perf_counter() - start)
+
+
+# Turn a scrolling message into pictures all at once.  Returns frames per
+# second, or None if the backend can't.
+def time_render(display, count):
+    render = getattr(display.backend, "render", None)
+    if render is None:
+        return None
+    frames = list(scroll_frames(display, count))
+    # Big displays are rendered a few frames at a time, so as not to run out
+    # of memory.
+    batch = max(1, RENDER_BATCH_BYTES // (display.width * display.height))
+    start = time.perf_counter()
+    for ii in range(0, len(frames), batch):
+        render(frames[ii:ii + batch])
+    return len(frames) / (time.perf_counter() - start)
+
+
+def bench(backend, cells, count):
+    start = time.perf_counter()
+    display = make_display(backend, cells)
+    built = time.perf_counter() - start
+
+    size = len(display.flags)
+    values = [0b01111111] * size
+    digits = [encode_text("%0*d" % (size, ii))[-size:] for ii in range(10)]
+
+    def set_cells(ii):
+        values[ii % size] ^= 0b10000000
+        display.set(*values)
+
+    results = {
+        "set": time_updates(display, set_cells, count),
+        "show_number": time_updates(display, display.show_number, count),
+        "show_frame": time_updates(
+            display, lambda ii: display.show_frame(digits[ii % 10]), count),
+    }
+    speeds = {"scroll": time_scroll(display, count),
+              "render": time_render(display, count)}
+    _close(display)
+    return built, results, speeds
+
+
+def _close(display):
+    root = getattr(display.backend, "root", None)
+    if root is not None:
+        root.destroy()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark seven-segment displays.")
+    parser.add_argument("--cells", type=int, nargs="+",
+                        default=[1, 8, 64, 512],
+                        help="sizes of display to try")
+    parser.add_argument("--backends", nargs="+", default=["raster", "tk"],
+                        choices=sorted(STARTUP))
+    parser.add_argument("--frames", type=int, default=200,
+                        help="frames to draw for each measurement")
+    args = parser.parse_args()
+
+    for backend in args.backends:
+        try:
+            imported, displayed = time_startup(backend)
+        except subprocess.CalledProcessError:
+            print("%s: can't run here, skipping" % backend)
+            continue
+        print("%s: import %.1f ms, first display %.1f ms" %
+              (backend, imported * 1000, displayed * 1000))
+        # Get the backend imported here too, so that it isn't counted in the
+        # first display's construction.
+        _close(make_display(backend, 1))
+        for cells in args.cells:
+            built, results, speeds = bench(backend, cells, args.frames)
+            print("  %5d cells: construct %8.2f ms, " % (cells, built * 1000) +
+                  ", ".join("%s %.0f frames/s" % (name, speed)
+                            for name, speed in speeds.items()
+                            if speed is not None))
+            for name, (per_call, stats) in results.items():
+                print("      %-11s %8.1f us/call, redraw p50 %8.1f us, "
+                      "p99 %8.1f us, max %8.1f us" %
+                      (name, per_call * 1e6, stats["redraw_p50"] * 1e6,
+                       stats["redraw_p99"] * 1e6, stats["redraw_max"] * 1e6))
+
+if __name__ == '__main__':
+    main()
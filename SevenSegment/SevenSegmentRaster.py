@@ -0,0 +1,268 @@
+# SevenSegmentRaster.py
+# Draws a seven-segment Display as images in memory, using NumPy, so it can
+# be used without a screen - for tests, or to make pictures and animations
+# of the display.
+#
+# Each segment's polygon is turned into a mask of the pixels it covers once,
+# when the display is created.  After that, drawing a cell is just picking
+# out the masks of the segments which are lit, and a whole display is drawn
+# in one go by looking up every cell's picture at once.  render() draws a
+# whole sequence of frames at a time, at hundreds to thousands of frames a
+# second depending on the size of the display.
+#
+# Example:
+#
+#   disp = Display(4, backend="raster")
+#   disp.set(0b00000110, 0b01011011, 0b01001111, 0b01100110)
+#   disp.backend.save_png("1234.png")
+#   image = disp.backend.frame()    # A height x width x 3 array of RGB.
+#
+# To make an animation, record each frame as it's drawn and save them as a
+# GIF:
+#
+#   disp = Display(8, backend=lambda d: RasterBackend(d, record=True))
+#   disp.demo()
+#   disp.backend.save_gif("hello.gif", delay=0.2)
+#
+# Needs the numpy package.
+import struct
+import zlib
+import numpy
+from SevenSegment import ScrollFrames, Scheduler, cell_segments
+
+# Colour numbers in the images this draws.  Each is looked up in the
+# palette to get the real colour.
+BACKGROUND = 0
+LINE = 1
+OFF = 2
+ON = 3
+
+
+# Work out which pixels are inside a polygon (given as a flat list of
+# coordinates x1, y1, x2, y2...), by counting how many of its edges lie to
+# the right of each pixel's centre.
+def polygon_mask(coords, width, height):
+    xs = coords[0::2]
+    ys = coords[1::2]
+    px = numpy.arange(width) + 0.5
+    py = numpy.arange(height)[:, None] + 0.5
+    inside = numpy.zeros((height, width), dtype=bool)
+    for ii in range(len(xs)):
+        x1, y1 = xs[ii - 1], ys[ii - 1]
+        x2, y2 = xs[ii], ys[ii]
+        if y1 == y2:
+            continue
+        crosses = (y1 > py) != (y2 > py)
+        x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (px < x_at)
+    return inside
+
+
+# The pixels around the edge of a mask: those inside it with a neighbour
+# outside it.
+def mask_edge(mask):
+    padded = numpy.pad(mask, 1)
+    interior = (padded[:-2, 1:-1] & padded[2:, 1:-1] &
+                padded[1:-1, :-2] & padded[1:-1, 2:])
+    return mask & ~interior
+
+
+# Turn a Tk colour such as "#00FF00" into (red, green, blue).
+def parse_color(color):
+    color = color.lstrip("#")
+    return tuple(int(color[ii:ii + 2], 16) for ii in (0, 2, 4))
+
+
+class RasterBackend():
+
+    # Parms:
+    #     display   - the Display being drawn.
+    #     record    - keep every frame drawn, to save as an animation.
+    #     scheduler - the Scheduler to run animations with.  Share one
+    #                 between displays to run them all from one loop.
+    def __init__(self, display, record=False, scheduler=None):
+        self.scheduler = scheduler or Scheduler()
+        self.width = display.width
+        self.height = display.height
+        self.border = display.border
+        self.rows = display.rows
+        self.columns = display.columns
+        self.palette = numpy.array([parse_color(display.bgcolor),
+                                    parse_color(display.linecolor),
+                                    parse_color(display.offcolor),
+                                    parse_color(display.oncolor)],
+                                   dtype=numpy.uint8)
+        cell_width = display.cell_width
+        cell_height = display.cell_height
+
+        # A mask of each segment's pixels within a cell, and of its outline.
+        self.masks = numpy.array([
+            polygon_mask(segment.coords, cell_width, cell_height)
+            for segment in cell_segments(cell_width, cell_height)])
+        edges = [mask_edge(mask) for mask in self.masks]
+
+        # A picture of a cell for every possible set of bitflags.  Each
+        # segment is filled in with the ON or OFF colour depending on its
+        # bit, then outlined.
+        values = numpy.arange(256)
+        self.tiles = numpy.zeros((256, cell_height, cell_width),
+                                 dtype=numpy.uint8)
+        for ii, mask in enumerate(self.masks):
+            lit = (values >> ii) & 1
+            self.tiles[:, mask] = numpy.where(lit, ON, OFF)[:, None]
+        for edge in edges:
+            self.tiles[:, edge] = LINE
+
+        self.flags = numpy.zeros(len(display.flags), dtype=numpy.uint8)
+        self.recorded = [] if record else None
+
+    def draw(self, flags):
+        self.flags = numpy.frombuffer(bytes(flags), dtype=numpy.uint8)
+        if self.recorded is not None:
+            self.recorded.append(self.flags)
+
+    # Draw many frames at once.  frames is a number of frames by number of
+    # cells array of bitflags, a list of frames as bytes, or ScrollFrames;
+    # returns a frames by height by width array of colour numbers.
+    def render(self, frames):
+        if isinstance(frames, ScrollFrames):
+            # Look at the message through a sliding window rather than
+            # copying out every frame.
+            message = numpy.frombuffer(frames.data, dtype=numpy.uint8)
+            frames = numpy.lib.stride_tricks.sliding_window_view(
+                message, frames.width)
+        elif len(frames) and isinstance(frames[0], bytes):
+            frames = numpy.frombuffer(b"".join(frames), dtype=numpy.uint8)
+            frames = frames.reshape(-1, len(self.flags))
+        frames = numpy.asarray(frames, dtype=numpy.uint8)
+        count = len(frames)
+        rows, columns = self.rows, self.columns
+        tiles = self.tiles[frames.reshape(count, rows, columns)]
+        tile_height, tile_width = tiles.shape[3:]
+        images = numpy.full((count, self.height, self.width), BACKGROUND,
+                            dtype=numpy.uint8)
+        # Lay the cells' pictures out in rows, inside the border.
+        inside = images[:, self.border:self.border + rows * tile_height,
+                        self.border:self.border + columns * tile_width]
+        inside.reshape(count, rows, tile_height, columns, tile_width)[...] = (
+            tiles.transpose(0, 1, 3, 2, 4))
+        return images
+
+    # The display as it is now, as a height by width array of colour
+    # numbers.
+    def indexed_frame(self):
+        return self.render(self.flags[None, :])[0]
+
+    # The display as it is now, as a height by width by 3 array of RGB.
+    def frame(self):
+        return self.palette[self.indexed_frame()]
+
+    def save_png(self, path):
+        write_png(path, self.frame())
+
+    # Save the recorded frames as an animated GIF, showing each for delay
+    # seconds.
+    def save_gif(self, path, delay=0.5):
+        if not self.recorded:
+            raise ValueError("No frames have been recorded")
+        write_gif(path, self.render(self.recorded), self.palette, delay)
+
+
+# Save a height by width by 3 array of RGB as a PNG file.
+def write_png(path, rgb):
+    rgb = numpy.ascontiguousarray(rgb, dtype=numpy.uint8)
+    height, width = rgb.shape[:2]
+
+    def chunk(kind, data):
+        return (struct.pack("!I", len(data)) + kind + data +
+                struct.pack("!I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    # Each row starts with a byte saying it isn't filtered.
+    rows = numpy.zeros((height, 1 + width * 3), dtype=numpy.uint8)
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+    with open(path, "wb") as output:
+        output.write(b"\x89PNG\r\n\x1a\n")
+        output.write(chunk(b"IHDR", struct.pack("!IIBBBBB", width, height,
+                                                8, 2, 0, 0, 0)))
+        output.write(chunk(b"IDAT", zlib.compress(rows.tobytes())))
+        output.write(chunk(b"IEND", b""))
+
+
+# Save a sequence of frames (a frames by height by width array of colour
+# numbers) as an animated GIF which loops forever.  palette has up to 256
+# colours, as rows of red, green, blue.
+def write_gif(path, frames, palette, delay=0.5):
+    frames = numpy.asarray(frames, dtype=numpy.uint8)
+    count, height, width = frames.shape
+    # The colour table must have a power of two entries, and at least 4.
+    bits = max(2, int(len(palette) - 1).bit_length())
+    table = numpy.zeros((2 ** bits, 3), dtype=numpy.uint8)
+    table[:len(palette)] = palette
+    centiseconds = int(round(delay * 100))
+
+    with open(path, "wb") as output:
+        output.write(b"GIF89a")
+        output.write(struct.pack("<HHBBB", width, height,
+                                 0x80 | (bits - 1), 0, 0))
+        output.write(table.tobytes())
+        # Loop forever.
+        output.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+        for frame in frames:
+            output.write(struct.pack("<BBBBHBB", 0x21, 0xF9, 4, 0,
+                                     centiseconds, 0, 0))
+            output.write(struct.pack("<BHHHHB", 0x2C, 0, 0, width, height, 0))
+            output.write(bytes([bits]))
+            data = _lzw_encode(frame.tobytes(), bits)
+            for ii in range(0, len(data), 255):
+                block = data[ii:ii + 255]
+                output.write(bytes([len(block)]) + block)
+            output.write(b"\x00")
+        output.write(b"\x3b")
+
+
+# Compress a frame's colour numbers the way GIF files need.
+def _lzw_encode(data, min_size):
+    clear = 1 << min_size
+    end = clear + 1
+    out = bytearray()
+    accumulator = 0
+    accumulated = 0
+    code_size = min_size + 1
+    table = {bytes([ii]): ii for ii in range(clear)}
+    next_code = end + 1
+
+    def emit(code, size):
+        nonlocal accumulator, accumulated
+        accumulator |= code << accumulated
+        accumulated += size
+        while accumulated >= 8:
+            out.append(accumulator & 0xFF)
+            accumulator >>= 8
+            accumulated -= 8
+
+    emit(clear, code_size)
+    prefix = data[:1]
+    for ii in range(1, len(data)):
+        candidate = data[ii - len(prefix):ii + 1]
+        if candidate in table:
+            prefix = candidate
+            continue
+        emit(table[prefix], code_size)
+        if next_code < 4096:
+            table[candidate] = next_code
+            next_code += 1
+            if next_code > 1 << code_size and code_size < 12:
+                code_size += 1
+        else:
+            # The table is full, so start again.
+            emit(clear, code_size)
+            table = {bytes([jj]): jj for jj in range(clear)}
+            next_code = end + 1
+            code_size = min_size + 1
+        prefix = data[ii:ii + 1]
+    if prefix:
+        emit(table[prefix], code_size)
+    emit(end, code_size)
+    if accumulated:
+        out.append(accumulator & 0xFF)
+    return bytes(out)
@@ -0,0 +1,240 @@
+# SevenSegmentServer.py
+# Lets other programs drive a seven-segment Display over a socket, so that
+# lots of them (e.g. telemetry from several processes) can share one
+# display without having to draw it themselves.
+#
+# Producers connect to the server and send it lines of text, each one an
+# update to some of the display's cells:
+#
+#   FLAGS <cell> <hex>           - set cells from <cell> onwards to raw
+#                                  bitflags, one byte (two hex digits) each,
+#                                  e.g. "FLAGS 0 3f065b".
+#   TEXT <cell> <count> <text>   - show text across <count> cells starting at
+#                                  <cell>, right-aligned (see encode_text()),
+#                                  e.g. "TEXT 4 4 12.5".
+#   CLEAR                        - blank the whole display.
+#
+# Cells are numbered from 0, row by row.  Lines which can't be understood are
+# counted in errors and otherwise ignored; nothing is sent back.
+#
+# Updates can arrive far faster than a window can be drawn.  Rather than
+# drawing each one, the server just keeps the latest state of every cell,
+# and fps times a second draws whatever has changed since last time, in one
+# go.  Bursts of updates are squashed together, but the last one always
+# gets drawn.
+#
+# To run a server with an 8 digit display:
+#
+#   python SevenSegmentServer.py --cells 8
+#
+# and to send it something from another program:
+#
+#   client = DisplayClient()
+#   client.text(0, 8, "HELLO")
+import argparse
+import socket
+import socketserver
+import threading
+from SevenSegment import Display, encode_text
+
+PORT = 7010
+
+# How many times a second to draw the display (at most).
+FPS = 30
+
+
+class DisplayServer():
+
+    # One producer's connection.  Each one is handled on its own thread.
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            owner = self.server.owner
+            with owner.lock:
+                owner.clients += 1
+            try:
+                for line in self.rfile:
+                    owner.handle_line(line.decode("utf-8", "replace"))
+            except OSError:
+                pass
+            finally:
+                with owner.lock:
+                    owner.clients -= 1
+
+    class TCPServer(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    # Parms:
+    #     display - the Display to draw updates on.
+    #     port    - the port to listen on.
+    #     localip - the address to listen on; only this machine by default.
+    #     fps     - how many times a second to draw the display (at most).
+    def __init__(self, display, port=PORT, localip="127.0.0.1", fps=FPS):
+        self.display = display
+        self.scheduler = display.scheduler
+        self.interval = 1.0 / fps
+        # The latest state of every cell, and whether it's changed since it
+        # was last drawn.  Both belong to self.lock.
+        self.lock = threading.Lock()
+        self.pending = bytearray(display.flags)
+        self.dirty = False
+        self.updates = 0
+        self.frames = 0
+        self.errors = 0
+        self.last_error = None
+        self.clients = 0
+        self.closing = False
+        self.finished = False
+        self.done_callbacks = []
+        self.server = self.TCPServer((localip, port), self.Handler)
+        self.server.owner = self
+        self.port = self.server.server_address[1]
+
+    # How many updates were squashed into a later one instead of being
+    # drawn.
+    @property
+    def coalesced(self):
+        return max(0, self.updates - self.frames)
+
+    # Start accepting updates, and drawing them on the display's scheduler.
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.start_time = self.scheduler.now()
+        self.next_frame = 1
+        self._schedule()
+
+    # Start, and keep the display going until close() is called.
+    def run(self):
+        self.start()
+        self.scheduler.wait_for(self)
+
+    # Stop accepting updates.  Safe to call from any thread: the display
+    # is left alone, and run() returns at the next frame.
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _finish(self):
+        self.finished = True
+        callbacks = self.done_callbacks
+        self.done_callbacks = []
+        for callback in callbacks:
+            callback()
+
+    # Call callback() once the server has been closed.  (This, along with
+    # finished, lets the display's scheduler wait for the server just as it
+    # would for an Animation.)
+    def add_done_callback(self, callback):
+        if self.finished:
+            callback()
+        else:
+            self.done_callbacks.append(callback)
+
+    # Apply one line from a producer.  Called on the producer's thread.
+    def handle_line(self, line):
+        try:
+            command, _, rest = line.rstrip("\r\n").partition(" ")
+            command = command.upper()
+            if command == "FLAGS":
+                cell, data = rest.split()
+                self.update(int(cell), bytes.fromhex(data))
+            elif command == "TEXT":
+                cell, count, text = (rest.split(" ", 2) + [""])[:3]
+                count = int(count)
+                if count < 0:
+                    raise ValueError("Can't show text in %d cells" % count)
+                codes = encode_text(text)[-count:] if count else b""
+                self.update(int(cell), bytes(count - len(codes)) + codes)
+            elif command == "CLEAR":
+                self.update(0, bytes(len(self.pending)))
+            elif command:
+                raise ValueError("Unknown command: %r" % command)
+        except ValueError as exp:
+            with self.lock:
+                self.errors += 1
+                self.last_error = str(exp)
+
+    # Set cells from cell onwards to the bitflags in codes, next time the
+    # display is drawn.  Safe to call from any thread.
+    def update(self, cell, codes):
+        if cell < 0 or cell + len(codes) > len(self.pending):
+            raise ValueError("Cells %d to %d aren't on the display" %
+                             (cell, cell + len(codes) - 1))
+        with self.lock:
+            self.pending[cell:cell + len(codes)] = codes
+            self.dirty = True
+            self.updates += 1
+
+    def _schedule(self):
+        self.scheduler.call_at(
+            self.start_time + self.next_frame * self.interval, self._tick)
+
+    # Draw the latest state, if it's changed, then wait for the next frame.
+    # Frames are timed from the start, like an Animation's, and any we're
+    # too late for are skipped.
+    def _tick(self):
+        if self.closing:
+            self._finish()
+            return
+        with self.lock:
+            frame = bytes(self.pending) if self.dirty else None
+            self.dirty = False
+        if frame is not None:
+            self.display.show_frame(frame)
+            self.frames += 1
+        due = int((self.scheduler.now() - self.start_time) / self.interval)
+        self.next_frame = max(self.next_frame, due) + 1
+        self._schedule()
+
+
+# Sends updates to a DisplayServer.
+class DisplayClient():
+
+    def __init__(self, host="127.0.0.1", port=PORT):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    # Set cells from cell onwards to the given bitflags.
+    def flags(self, cell, values):
+        self.send("FLAGS %d %s" % (cell, bytes(values).hex()))
+
+    # Show text across count cells, starting at cell.
+    def text(self, cell, count, text):
+        self.send("TEXT %d %d %s" % (cell, count, text))
+
+    def clear(self):
+        self.send("CLEAR")
+
+    def send(self, line):
+        self.sock.sendall(line.encode("utf-8") + b"\n")
+
+    def close(self):
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show updates sent over a socket on a seven-segment "
+                    "display.")
+    parser.add_argument("--cells", type=int, default=8,
+                        help="digits in each row")
+    parser.add_argument("--rows", type=int, default=1)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--fps", type=float, default=FPS,
+                        help="most times a second to draw the display")
+    args = parser.parse_args()
+
+    server = DisplayServer(Display(args.cells, rows=args.rows),
+                           port=args.port, fps=args.fps)
+    print("Listening on port %d" % server.port)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.close()
+
+if __name__ == '__main__':
+    main()
@@ -9,19 +9,30 @@
 # Provided under Creative Commons license
 # http://creativecommons.org/licenses/by-sa/4.0
 import threading
-import subprocess
 import socket
 import select
+import struct
 import time
 from morse_lookup import *
+from morse_protocol import FrameParser, KeyEvent, ProtocolError, encode_frame, encode_join, KEY_DOWN, KEY_UP
+from morse_timing import TimingEstimator
+from morse_recorder import SessionRecorder
+from morse_discovery import Discovery
+from morse_metrics import WireStats
+from morse_ring import SymbolRing, BUFFER_SIZE, DROP_NEWEST, DROP_OLDEST
+from morse_sinks import StdoutSink
 
 # Set up some constants for the duration of a DOT.  This is the time unit
-# about which everything else is based.  If you get good at Morse code,
-# reduce the time unit.
+# about which everything else is based.  The wire starts off assuming this
+# speed, then adapts to however fast the other person actually sends (see
+# morse_timing.py).
 TIME_UNIT = 0.2
 LETTER_GAP = 3 * TIME_UNIT
 WORD_GAP = 7 * TIME_UNIT
 
+# The TCP port the server end listens on.
+PORT = 10000
+
 class Wire():
 
     PRESSED = "1"
@@ -34,41 +45,113 @@ class Wire():
     DASH = "-"
     DOT = "."
 
-    # Gets the local IP address of the system.  Assumes there's only 1 IPv4
-    # address which isn't the loopback address, and it only works with IPv4.
-    def get_local_ip(self):
-        # Run the native "ip addr show" command and parse the output to find
-        # the system's IP address.
-        output = subprocess.check_output(
-            'ip addr show | grep "inet " | grep -v "127.0.0.1"',
-            shell=True)
-        output = output.decode('utf-8')
-        prefix = output.split()[1]
-        ipaddr = prefix.split('/')[0]
-        return ipaddr
-
-    def __init__(self, role=UNSPECIFIED):
-        self.localip = self.get_local_ip()
+    # Gets the local IP address of the system (IPv4 only).  If an interface
+    # name such as "wlan0" is given, we use that interface's address (Linux
+    # only).  Otherwise we use whichever address the system would send from
+    # to reach another computer, which skips the loopback address.
+    def get_local_ip(self, interface=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            if interface is not None:
+                import fcntl
+                SIOCGIFADDR = 0x8915
+                request = struct.pack("256s", interface.encode("utf-8")[:15])
+                result = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+                return socket.inet_ntoa(result[20:24])
+            try:
+                # Connecting a UDP socket doesn't send anything - it just
+                # makes the system pick the address it would send from.
+                sock.connect(("10.255.255.255", 1))
+                return sock.getsockname()[0]
+            except OSError:
+                # No route anywhere, so this computer is on its own.
+                return "127.0.0.1"
+        finally:
+            sock.close()
+
+    # If you're connecting to a hub (see morse_hub.py), channel says which of
+    # the hub's channels to join.  localip or interface can be used to choose
+    # which of this computer's addresses to use, if it has more than one.
+    # buffer_size and overflow control the buffer of received key presses
+    # waiting to be decoded (see morse_ring.py).
+    def __init__(self, role=UNSPECIFIED, port=PORT, channel=None,
+                 localip=None, interface=None, buffer_size=BUFFER_SIZE,
+                 overflow=DROP_OLDEST):
+        if localip is None:
+            localip = self.get_local_ip(interface)
+        self.localip = localip
         self.connected = False
         self.key_up_time = 0
-        self.buffer = []
+        self.buffer = SymbolRing(buffer_size, overflow)
+        # The listener notifies this condition whenever a key event arrives,
+        # so the decoder can sleep until the next letter or word boundary
+        # rather than polling the clock.
+        self.decode_ready = threading.Condition()
+        self.listening = False
         self.is_receiving = None
         self.not_receiving = None
         self.role = role
+        self.port = port
+        self.channel = channel
+        self.peer = None
+        self.recorder = None
         self.test_mode = False
+        self.test_passed = threading.Event()
         self.button_state = self.RELEASED
         self.buzzer_state = self.OFF
+        self.send_seq = 0
+        # The listener and decoder threads for the current connection.
+        self.threads = []
+        # What the wire has been up to (see morse_metrics.py).
+        self.stats = WireStats()
+        # Where decoded text goes (see morse_sinks.py).
+        self.sinks = [StdoutSink()]
+        self._reset_receiver()
 
     # Connect to the other end and start listening.
-    def connect(self, self_test=True):
+    # Parms:
+    #     self_test - check the button and buzzer work first.
+    #     remoteip  - the other person's address.  If it isn't given, we ask
+    #                 for it, unless...
+    #     discover  - ...this is True, in which case we find another station
+    #                 on the local network automatically (see
+    #                 morse_discovery.py).
+    #     code      - when discovering, only pair with a station that was
+    #                 given the same code.
+    def connect(self, self_test=True, remoteip=None, discover=False, code=""):
         # By default we do a quick self-test so it's easy to see when people
         # haven't wired up properly.
         if self_test:
             self.self_test()
-        
-        print("Your address is %s" % self.localip)
-        self.remoteip = input("Please enter the other person's address: ")
 
+        if remoteip is not None:
+            self.remoteip = remoteip
+        elif discover:
+            self._discover(code)
+        else:
+            print("Your address is %s" % self.localip)
+            self.remoteip = input("Please enter the other person's address: ")
+        self._choose_role()
+        self.reconnect()
+
+    # Find another station to talk to on the local network.
+    def _discover(self, code):
+        print("Looking for another station...")
+        discovery = Discovery(self.port, code)
+        address, port, their_id = discovery.find_peer()
+        print("Found a station at %s" % address)
+        self.remoteip = address
+        if self.role == self.UNSPECIFIED:
+            # We might both have the same address (e.g. two stations on one
+            # computer), so use the ids we picked to decide who's the server.
+            if discovery.station_id < their_id:
+                self.role = self.SERVER
+            else:
+                self.role = self.CLIENT
+        if self.role == self.CLIENT:
+            self.port = port
+
+    def _choose_role(self):
         if self.role == self.UNSPECIFIED:
             # The user hasn't specified which role they want, so arbitrarily
             # choose who's going to be client and server by comparing the IP
@@ -81,31 +164,59 @@ class Wire():
                 self.role = self.SERVER
             else:
                 self.role = self.CLIENT
-        self.reconnect()
 
     def reconnect(self):        
         if not self.connected:
+            # Let the last connection's threads finish with the buffer
+            # before starting again.
+            self._join_threads()
             if self.role == self.SERVER:
                 self.start_server()
             else:
                 self.start_client()
+            if self.channel is not None:
+                self._send_frame(encode_join(self.channel))
+
+            self.stats.connections += 1
+            self.listening = True
+            self._reset_receiver()
+            self.threads = [threading.Thread(target=target, args=())
+                            for target in (self.decoder_thread,
+                                           self.listen_for_signal)]
+            for thread in self.threads:
+                thread.start()
+
+    # Hang up, and wait for the listener to tidy up and the decoder to
+    # output whatever was left.
+    def close(self):
+        if self.connected:
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # The listener has closed it already.
+                pass
+        self._join_threads()
 
-            decoder_t = threading.Thread(target=self.decoder_thread, args=())
-            decoder_t.start()
-            t = threading.Thread(target=self.listen_for_signal, args=())
-            t.start()
+    def _join_threads(self):
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.threads = []
 
     # Start the connection, acting as server.
     def start_server(self):
         # Create and bind a listen socket.
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_address = (self.localip, 10000)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_address = (self.localip, self.port)
         self.sock.bind(server_address)
         self.sock.listen(1)
 
         # Wait for a connection
         print("Waiting for the other end to connect")
         self.connection, self.client_address = self.sock.accept()
+        self.peer = self.client_address[0]
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         print("Connected!\n\n  PRESS CTRL-C TO STOP THE PROGRAM\n\n")
         self.connected = True
 
@@ -113,21 +224,24 @@ class Wire():
     def start_client(self):
         # Connect a socket and attempt to connect to the server.
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_address = (self.remoteip, 10000)
+        server_address = (self.remoteip, self.port)
         print("Connecting to the other end...")
 
         # Keep trying until connected.  If the other end refuses the connection
         # then that probably means the other end just hasn't started up yet, so
-        # wait and try again.  Any other exceptions (e.g. the other end isn't
-        # routable) should be re-raised.
+        # wait and try again - quickly at first, then less often.  Any other
+        # exceptions (e.g. the other end isn't routable) should be re-raised.
+        delay = 0.1
         while not self.connected:
             try:
                 self.sock.connect(server_address)
                 self.connected = True
             except socket.error as exp:
                 if exp.errno == socket.errno.ECONNREFUSED:
-                    print("...waiting for the other end to start up...")
-                    time.sleep(5)
+                    if delay >= 1:
+                        print("...waiting for the other end to start up...")
+                    time.sleep(delay)
+                    delay = min(delay * 2, 5)
                 else:
                     raise
             except:
@@ -135,6 +249,8 @@ class Wire():
 
         print("Connected!\n\n  PRESS CTRL-C TO STOP THE PROGRAM\n\n")
         self.connection = self.sock
+        self.peer = self.remoteip
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     @property
     def is_receiving(self):
@@ -152,6 +268,18 @@ class Wire():
     def not_receiving(self, callback):
         self._not_receiving = callback
 
+    # Tell the wire whether your button is pressed (PRESSED) or not
+    # (RELEASED).
+    def my_button(self, state):
+        if state == self.PRESSED:
+            self.send_signal()
+        else:
+            self.stop_signal()
+
+    # Check whether the other end wants our buzzer to be on.
+    def my_buzzer(self):
+        return self.buzzer_state == self.ON
+
     def send_signal(self):
         if self.test_mode:
             # We're in test mode, so just print a message to say that the button
@@ -167,6 +295,7 @@ class Wire():
             print("Button release works.  Hooray.  Turning buzzer off.")
             self._not_receiving()
             self.test_mode = False
+            self.test_passed.set()
         else:
             self._signal_on_wire(self.OFF)
 
@@ -175,13 +304,25 @@ class Wire():
     def _signal_on_wire(self, state):
         if state != self.button_state:
             self.button_state = state
-            # Send a message consisting of an ASCII digit to
-            # represent the button state.
-            message = "%s" % self.button_state
-            self.connection.sendall(bytes(message, 'utf-8'))
+            # Send a frame describing the change, stamped with our clock so
+            # the other end can time it accurately.
+            self.send_seq += 1
+            event = KeyEvent(self.send_seq, time.monotonic(),
+                             KEY_DOWN if state == self.ON else KEY_UP)
+            self._send_event(event)
+
+    def _send_event(self, event):
+        frame = encode_frame([event])
+        self._send_frame(frame)
+        self.stats.events_sent += 1
+        self.stats.bytes_sent += len(frame)
+
+    def _send_frame(self, frame):
+        self.connection.sendall(frame)
 
     def listen_for_signal(self):
         received_a_signal = False
+        parser = FrameParser()
         try:
             while True:
                 ready = select.select([self.connection], [], [])
@@ -190,22 +331,135 @@ class Wire():
                         print("Receiving OK")
                         received_a_signal = True
                     data = self.connection.recv(4096)
-                    data = data.decode('utf-8')
-                    data = data[-1:]
-                    if data == self.ON:
-                        self._is_receiving()
-                        # Record time that the other person's button was pressed.
-                        key_down_time = time.time()
-                    else:
-                        self._not_receiving()
-                        # Record time that the other person's button was released.
-                        self.key_up_time = time.time()
-                        key_down_length = self.key_up_time - key_down_time
-                        self.buffer.append(self.DASH if key_down_length > TIME_UNIT else self.DOT)
-        except:
-            self.sock.close()
+                    received_at = time.monotonic()
+                    if not data:
+                        # The other end has hung up.
+                        break
+                    self.stats.bytes_received += len(data)
+                    # Act on every event that arrived, not just the last one,
+                    # so nothing is lost when several turn up together.
+                    self._receive_events(parser.feed(data), received_at)
+        except (OSError, ProtocolError) as exp:
+            # Keep a note of what went wrong rather than losing it.
+            self.stats.record_error(exp)
+            print("Lost the connection: %s" % exp)
         finally:
             self.connected = False
+            # Close the connection, and (for a server) the socket it was
+            # accepted on - reconnect() makes new ones.
+            self.connection.close()
+            self.sock.close()
+            if self.recorder is not None:
+                self.recorder.flush()
+            # Let the decoder flush anything outstanding and exit.
+            with self.decode_ready:
+                self._cut_off()
+                self.listening = False
+                self.decode_ready.notify()
+
+    # The connection has ended.  If the key was down, the letter being sent
+    # has been cut off: throw it away, and turn the buzzer off.
+    def _cut_off(self):
+        if self.key_down_timestamp is not None:
+            self.key_down_timestamp = None
+            self.buffer.clear()
+            self.buzzer_state = self.OFF
+            self._not_receiving()
+
+    # Record every key event we receive to a log file (see morse_recorder.py).
+    def record_to(self, path):
+        self.stop_recording()
+        self.recorder = SessionRecorder(path)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    # Forget everything we knew about the last connection - including how
+    # fast they were sending - ready for a new one.  (The last connection's
+    # threads must have finished.)
+    def _reset_receiver(self):
+        self.buffer.clear()
+        self.last_seq = 0
+        self.key_down_timestamp = None
+        self.key_up_timestamp = None
+        self.gap = None
+        self.timing = TimingEstimator(TIME_UNIT)
+
+    # Act on key events that have arrived from the other end.  received_at
+    # is when they arrived, for timing how long our callbacks take to hear
+    # about them.
+    def _receive_events(self, events, received_at=None):
+        if received_at is None:
+            received_at = time.monotonic()
+        stats = self.stats
+        for event in events:
+            if event.seq <= self.last_seq:
+                # We've seen this one already.
+                stats.duplicate_events += 1
+                continue
+            # Events can go missing on the way (e.g. a hub drops some when
+            # we can't keep up), leaving a gap in the numbers.  Whatever
+            # happened in the gap can't be timed.
+            lost = event.seq - self.last_seq - 1
+            if lost:
+                stats.lost_events += lost
+                self.key_up_timestamp = None
+            self.last_seq = event.seq
+            stats.events_received += 1
+            if self.recorder is not None:
+                self.recorder.record(event.timestamp, event.state, self.peer)
+            if event.state == KEY_DOWN:
+                self.buzzer_state = self.ON
+                self._is_receiving()
+                # Record when the other person's button was pressed,
+                # according to their clock, and learn from how long it was
+                # up beforehand.
+                self.key_down_timestamp = event.timestamp
+                self.gap = None
+                if self.key_up_timestamp is not None:
+                    self.gap = event.timestamp - self.key_up_timestamp
+                    stats.gaps.record(self.gap)
+                    self.timing.key_up(self.gap)
+            elif self.key_down_timestamp is not None:
+                self.buzzer_state = self.OFF
+                self._not_receiving()
+                # The length of the press comes from the sender's timestamps,
+                # so network delays don't turn dots into dashes.
+                key_down_length = event.timestamp - self.key_down_timestamp
+                self.key_down_timestamp = None
+                self.key_up_timestamp = event.timestamp
+                if lost:
+                    continue
+                stats.key_down.record(key_down_length)
+                self.timing.key_down(key_down_length)
+                self._add_press(self.gap, key_down_length)
+            else:
+                continue
+            stats.callback_latency.record(time.monotonic() - received_at)
+
+    # Get the wire's stats (see morse_metrics.py), along with how things
+    # stand right now.
+    def stats_snapshot(self):
+        snapshot = self.stats.snapshot()
+        snapshot["connected"] = self.connected
+        snapshot["buffer_depth"] = len(self.buffer)
+        snapshot["buffer_overflows"] = self.buffer.overflows
+        snapshot["wpm"] = self.timing.wpm
+        return snapshot
+
+    # Record a press (see morse_ring.py), and wake the decoder so it can
+    # work out when this letter ends.  The time is set before the press goes
+    # in, so the decoder never sees the press with the previous one's time.
+    def _add_press(self, gap, length):
+        self.key_up_time = time.monotonic()
+        self.buffer.push(gap, length)
+        depth = len(self.buffer)
+        if depth > self.stats.max_buffer_depth:
+            self.stats.max_buffer_depth = depth
+        with self.decode_ready:
+            self.decode_ready.notify()
 
     def self_test(self):
         """Perform a self-test to make sure the button and buzzer are
@@ -214,6 +468,7 @@ class Wire():
         # Set a flag to indicate to the functions triggered by the button that
         # we're in test mode, so we don't really need to send signals - we
         # just need to print a message and exit test mode.
+        self.test_passed.clear()
         self.test_mode = True
         if self._is_receiving is None:
             print ("You haven't set the wire's is_receiving function. Check the code")
@@ -225,20 +480,81 @@ class Wire():
         self._is_receiving()
         print("Push your button to turn the buzzer off.  If this doesn't work,\npress Ctrl-C to stop the program, then check your code and wiring.")
 
-        while self.test_mode:
-            pass
+        # Block until stop_signal() tells us the button was released.
+        self.test_passed.wait()
 
+    # Wait for the end of each letter and word, and decode what was received.
+    # Rather than waking up every few milliseconds to look at the clock, we
+    # work out when the next boundary is due and sleep until then, or until
+    # the listener tells us another key event has arrived.  When the line is
+    # idle there's nothing due, so we sleep until the next key event.
     def decoder_thread(self):
         new_word = False
         while True:
-            time.sleep(.01)
-            key_up_length = time.time() - self.key_up_time
-            if len(self.buffer) > 0 and key_up_length >= WORD_GAP:
-                new_word = True
-                bit_string = "".join(self.buffer)
-                try_decode(bit_string)
-                del self.buffer[:]
-            elif new_word and key_up_length >= 4.5:
-                new_word = False
-                sys.stdout.write(" ")
-                sys.stdout.flush()
+            with self.decode_ready:
+                deadline = self._next_boundary(new_word)
+                if deadline is None:
+                    if not self.listening:
+                        self._flush_sinks()
+                        return
+                    self.decode_ready.wait()
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining > 0 and self.listening:
+                    self.decode_ready.wait(remaining)
+                    continue
+
+                # Take the letter while we hold the lock, so anything the
+                # listener adds in the meantime is left for the next one, and
+                # _cut_off() can't clear the buffer under us.
+                presses = self.buffer.take()
+
+            new_word = self._decode(presses)
+
+    # Work out when the next letter or word boundary is due, or None if
+    # there's nothing waiting for one.
+    def _next_boundary(self, new_word):
+        if self.key_down_timestamp is not None:
+            # The key is down, so whatever they're sending isn't finished.
+            return None
+        elif self.buffer:
+            return self.key_up_time + self.timing.letter_gap
+        elif new_word:
+            return self.key_up_time + self.timing.word_gap
+        return None
+
+    # Decode a letter once its boundary has passed, or output a space at
+    # the end of a word.  presses is what the buffer's take() gave: the
+    # letter's presses, which are split into letters now that we know as
+    # much about the sender's timing as we're going to (there may turn out
+    # to be more than one), or an empty list for the end of a word, or None
+    # if some were lost.  Returns whether we're now waiting for the end of a
+    # word.
+    def _decode(self, presses):
+        if presses is None:
+            self.stats.unknown_letters += 1
+            return True
+        if not presses:
+            self._output(" ")
+            return False
+        for symbols in self.timing.split_letters(presses):
+            if symbols == " ":
+                self._output(" ")
+                continue
+            letter = decode_letter(symbols)
+            if letter is None:
+                self.stats.unknown_letters += 1
+            else:
+                self.stats.letters_decoded += 1
+                self._output(letter)
+        return True
+
+    # Hand decoded text to each of the sinks.
+    def _output(self, text):
+        for sink in self.sinks:
+            sink.write(text, self)
+
+    def _flush_sinks(self):
+        for sink in self.sinks:
+            sink.flush()
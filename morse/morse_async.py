@@ -0,0 +1,314 @@
+# morse_async.py
+# A version of the Wire which runs on an asyncio event loop instead of
+# using threads.
+#
+# An AsyncWire behaves just like a Wire - you set its is_receiving and
+# not_receiving callbacks and call send_signal()/stop_signal() (or
+# my_button()) when your button changes - but connecting, listening,
+# decoding and reconnecting all happen as coroutines on one event loop.
+# That means a single process can look after lots of wires at once without
+# needing two threads for each of them.
+#
+# Example:
+#
+#   async def main():
+#       w = AsyncWire(role=Wire.CLIENT)
+#       w.is_receiving = buzzer_on
+#       w.not_receiving = buzzer_off
+#       await w.connect("192.168.0.10", self_test=False)
+#       ...
+#       await w.close()
+#
+#   asyncio.run(main())
+#
+# Run this file directly to compare how much memory and how many context
+# switches a number of threaded and asyncio wires use:
+#
+#   python morse_async.py [async|thread] [number of pairs]
+import asyncio
+import socket
+import time
+from morse import *
+from morse_protocol import FrameParser, ProtocolError, encode_join
+
+# Reconnect delays (seconds).  Each failed attempt doubles the delay up to
+# the maximum, and it goes back to the start once we're connected again.
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30
+
+
+class AsyncWire(Wire):
+
+    # Parms as for Wire.
+    def __init__(self, role=Wire.UNSPECIFIED, port=PORT, channel=None,
+                 **kwargs):
+        Wire.__init__(self, role, port, channel, **kwargs)
+        self.loop = None
+        self.writer = None
+        self.server = None
+        self.task = None
+        self.decoder_task = None
+        self.remoteip = None
+        # Set by the listener whenever a key event arrives, to wake the
+        # decoder.
+        self.key_event = None
+        self.connected_event = None
+        self.session_ended = None
+        self.closing = False
+        # Whether the decoder is waiting for the end of a word.
+        self.new_word = False
+
+    # Connect to the other end and start listening.  Returns once we're
+    # connected - after that, the wire keeps itself connected in the
+    # background until close() is called.
+    async def connect(self, remoteip=None, self_test=True, discover=False,
+                      code=""):
+        self.loop = asyncio.get_running_loop()
+        self.key_event = asyncio.Event()
+        self.connected_event = asyncio.Event()
+        self.session_ended = asyncio.Event()
+        self.closing = False
+
+        if self_test:
+            # The self test waits for a real button, so don't hold up the
+            # event loop while it does.
+            await self.loop.run_in_executor(None, self.self_test)
+
+        if remoteip is not None:
+            self.remoteip = remoteip
+        elif discover:
+            await self.loop.run_in_executor(None, self._discover, code)
+        else:
+            print("Your address is %s" % self.localip)
+            self.remoteip = await self.loop.run_in_executor(
+                None, input, "Please enter the other person's address: ")
+        self._choose_role()
+
+        if self.role == self.SERVER:
+            self.server = await asyncio.start_server(self._session,
+                                                     self.localip, self.port)
+            print("Waiting for the other end to connect")
+        else:
+            self.task = asyncio.ensure_future(self._keep_connected())
+        self.decoder_task = asyncio.ensure_future(self.decoder())
+        await self.connected_event.wait()
+
+    # Disconnect and stop everything the wire was running.
+    async def close(self):
+        self.closing = True
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.writer is not None:
+            # Closing the connection ends the session; wait for it to tidy
+            # up before stopping everything else.
+            self.writer.close()
+            await self.session_ended.wait()
+        for task in (self.task, self.decoder_task):
+            if task is not None:
+                task.cancel()
+        self.task = None
+        self.decoder_task = None
+        self._flush_sinks()
+
+    # Keep the client end connected, backing off between attempts when the
+    # other end isn't there.
+    async def _keep_connected(self):
+        delay = RECONNECT_DELAY
+        while not self.closing:
+            try:
+                reader, writer = await asyncio.open_connection(self.remoteip,
+                                                               self.port)
+            except OSError:
+                if not self.connected_event.is_set():
+                    print("...waiting for the other end to start up...")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+            await self._session(reader, writer)
+
+    # Look after one connection until the other end goes away.
+    async def _session(self, reader, writer):
+        if self.connected:
+            # We only talk to one other station at a time.
+            writer.close()
+            return
+
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername")[0]
+        if self.channel is not None:
+            writer.write(encode_join(self.channel))
+        self.session_ended.clear()
+        self.stats.connections += 1
+        self.connected = True
+        self.listening = True
+        self._reset_receiver()
+        print("Connected!\n\n  PRESS CTRL-C TO STOP THE PROGRAM\n\n")
+        self.connected_event.set()
+
+        parser = FrameParser()
+        try:
+            await self.listen_for_signal(reader, parser)
+        except (OSError, ProtocolError) as exp:
+            self.stats.record_error(exp)
+        finally:
+            self.connected = False
+            self.listening = False
+            self.writer = None
+            writer.close()
+            self._finish_decoding()
+            self.key_event.set()
+            self.session_ended.set()
+
+    async def listen_for_signal(self, reader, parser):
+        received_a_signal = False
+        while True:
+            data = await reader.read(4096)
+            received_at = time.monotonic()
+            if not data:
+                # The other end has hung up.
+                return
+            if not received_a_signal:
+                print("Receiving OK")
+                received_a_signal = True
+            self.stats.bytes_received += len(data)
+            self._receive_events(parser.feed(data), received_at)
+
+    def _add_press(self, gap, length):
+        self.key_up_time = time.monotonic()
+        self.buffer.push(gap, length)
+        depth = len(self.buffer)
+        if depth > self.stats.max_buffer_depth:
+            self.stats.max_buffer_depth = depth
+        self.key_event.set()
+
+    # The same job as Wire.decoder_thread: sleep until the next letter or
+    # word boundary, or until another key event arrives.
+    async def decoder(self):
+        while True:
+            self.key_event.clear()
+            deadline = self._next_boundary(self.new_word)
+            if deadline is None:
+                await self.key_event.wait()
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining > 0 and self.listening:
+                try:
+                    await asyncio.wait_for(self.key_event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.new_word = self._decode(self.buffer.take())
+
+    # Once a session has ended, decode what's left straight away, as
+    # Wire.decoder_thread does, and flush it out to the sinks.
+    def _finish_decoding(self):
+        self._cut_off()
+        while self._next_boundary(self.new_word) is not None:
+            self.new_word = self._decode(self.buffer.take())
+        self._flush_sinks()
+
+    # Button presses may come from another thread (e.g. a GPIO callback), so
+    # hand the frame over to the event loop to send.
+    def _send_frame(self, frame):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._write_frame, frame)
+
+    def _write_frame(self, frame):
+        if self.writer is not None:
+            self.writer.write(frame)
+
+
+# Keying used by the comparison below: "PARIS " at 20 WPM.
+def _keying(unit=0.06):
+    elements = [1, 3, 3, 1, 0, 1, 3, 0, 1, 3, 1, 0, 1, 1, 0, 1, 1, 1]
+    for length in elements:
+        if length == 0:
+            yield 0, 2 * unit
+        else:
+            yield length * unit, unit
+
+
+async def _compare_async(pairs, base_port):
+    wires = []
+    for ii in range(pairs):
+        for role in (Wire.SERVER, Wire.CLIENT):
+            w = AsyncWire(role=role, port=base_port + ii,
+                          localip="127.0.0.1")
+            w.is_receiving = lambda: None
+            w.not_receiving = lambda: None
+            wires.append(w)
+    await asyncio.gather(*(w.connect("127.0.0.1", self_test=False)
+                           for w in wires))
+    senders = wires[1::2]
+    for down, up in _keying():
+        if down:
+            for w in senders:
+                w.send_signal()
+            await asyncio.sleep(down)
+            for w in senders:
+                w.stop_signal()
+        await asyncio.sleep(up)
+    await asyncio.sleep(WORD_GAP + 0.1)
+    for w in wires:
+        await w.close()
+
+
+def _compare_threads(pairs, base_port):
+    import threading
+    wires = []
+    for ii in range(pairs):
+        server = Wire(role=Wire.SERVER, port=base_port + ii)
+        client = Wire(role=Wire.CLIENT, port=base_port + ii)
+        for w in (server, client):
+            w.localip = w.remoteip = "127.0.0.1"
+            w.is_receiving = lambda: None
+            w.not_receiving = lambda: None
+        t = threading.Thread(target=server.reconnect)
+        t.start()
+        time.sleep(0.05)
+        client.reconnect()
+        t.join()
+        wires.append((server, client))
+    for down, up in _keying():
+        if down:
+            for _, w in wires:
+                w.send_signal()
+            time.sleep(down)
+            for _, w in wires:
+                w.stop_signal()
+        time.sleep(up)
+    time.sleep(WORD_GAP + 0.1)
+    for server, client in wires:
+        client.close()
+        server.close()
+
+
+def main():
+    import resource
+    import sys
+    mode = sys.argv[1] if len(sys.argv) > 1 else "async"
+    pairs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    start = resource.getrusage(resource.RUSAGE_SELF)
+    if mode == "async":
+        asyncio.run(_compare_async(pairs, 20000))
+    else:
+        _compare_threads(pairs, 21000)
+    end = resource.getrusage(resource.RUSAGE_SELF)
+    stations = 2 * pairs
+    print("\n%s: %d stations" % (mode, stations))
+    print("  max RSS:                      %d KiB" % end.ru_maxrss)
+    print("  voluntary context switches:   %.1f per station" %
+          ((end.ru_nvcsw - start.ru_nvcsw) / stations))
+    print("  involuntary context switches: %.1f per station" %
+          ((end.ru_nivcsw - start.ru_nivcsw) / stations))
+
+if __name__ == '__main__':
+    main()
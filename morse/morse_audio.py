@@ -0,0 +1,278 @@
+# morse_audio.py
+# Decode Morse code from a recording of a buzzer or CW tone.
+#
+# The audio is read a chunk at a time, so files of any length can be decoded
+# without loading them into memory.  Each chunk is cut into short blocks and
+# the strength of the tone in each block is measured (a single-frequency DFT,
+# the same thing a Goertzel filter works out, done for all the blocks at
+# once with NumPy).  Blocks where the tone is strong enough count as the key
+# being down, and the presses and gaps that gives are decoded just as they
+# would be if they had come over a Wire.
+#
+# Nothing is decoded until the tone has clearly turned up, so noise before
+# the first message isn't mistaken for keying (and doesn't put the decoder
+# off the sender's speed).
+#
+# Needs the numpy package.
+#
+# Usage:
+#
+#   python morse_audio.py recording.wav [--tone HZ]
+#
+# If the tone's frequency isn't given, it's worked out from the recording:
+# the first stretch of audio with one frequency clearly stronger than all
+# the others.
+import argparse
+import collections
+import math
+import sys
+import wave
+import numpy
+from morse import TIME_UNIT
+from morse_timing import KeyDecoder
+
+# Length of each block the tone is measured over (seconds).  Short enough to
+# time a dot at 40+ WPM, long enough to pick the tone out of the noise.
+BLOCK = 0.005
+
+# Look for the tone between these frequencies when we have to find it.
+MIN_TONE = 200
+MAX_TONE = 3000
+
+# When finding the tone, the strongest frequency has to be this many times
+# stronger (in power) than a typical one before we believe it's the tone.
+TONE_PROMINENCE = 100
+
+# The tone has to be this many times stronger (in power) than the
+# background, for CONFIRM_BLOCKS blocks in a row, before we believe it's
+# there at all.
+MIN_SNR = 10
+CONFIRM_BLOCKS = 3
+
+# How much of the audio to measure the background over (seconds).  Longer
+# than any gap between words, so there's always some silence in it.
+FLOOR_WINDOW = 10.0
+
+# The background is measured from the quietest blocks: this percentile of
+# them.  With nothing but noise, a block's power has an exponential
+# distribution, so its mean can be worked out from any percentile.
+FLOOR_PERCENTILE = 10
+
+# The key goes down when the tone rises above the threshold, and only comes
+# back up when it falls this many times (in power) below it, so noise on
+# top of the tone doesn't break presses up.
+HYSTERESIS = 4
+
+# How quickly we forget how loud the tone was (seconds to halve).
+PEAK_HALF_LIFE = 5.0
+
+
+class AudioDecoder():
+
+    # Parms:
+    #     sample_rate - samples per second of the audio that will be fed in.
+    #     tone        - frequency of the tone in Hz, or None to find it in
+    #                   the audio.
+    #     unit        - starting guess at the dot length, in seconds.
+    def __init__(self, sample_rate, tone=None, unit=TIME_UNIT):
+        self.sample_rate = sample_rate
+        self.block_size = max(1, int(round(sample_rate * BLOCK)))
+        self.block_time = self.block_size / sample_rate
+        self.tone = tone
+        self.reference = None
+        self.leftover = numpy.zeros(0)
+        self.blocks_seen = 0
+        self.peak = 0.0
+        # Recent blocks' power and whether the key was down in each, for
+        # measuring the background noise.
+        window = max(1, int(FLOOR_WINDOW / self.block_time))
+        self.history = collections.deque(maxlen=window)
+        self.key_history = collections.deque(maxlen=window)
+        self.noise = None
+        self.confirmed = False
+        # The last two raw key states, for smoothing across chunk boundaries.
+        self.recent = numpy.zeros(2, dtype=bool)
+        self.raw_key = False
+        self.key_is_down = False
+        self.decoder = KeyDecoder(unit)
+
+    # Decode a chunk of mono samples (any scale).  Returns any text that is
+    # now complete.
+    def feed(self, samples):
+        samples = numpy.concatenate((self.leftover,
+                                     numpy.asarray(samples, dtype=float)))
+        if self.tone is None:
+            self.tone = find_tone(samples, self.sample_rate)
+            if self.tone is None:
+                # No tone yet: skip this audio, keeping track of the time.
+                count = len(samples) // self.block_size
+                self.leftover = samples[count * self.block_size:]
+                self.blocks_seen += count
+                return ""
+        if self.reference is None:
+            phase = (2 * numpy.pi * self.tone / self.sample_rate *
+                     numpy.arange(self.block_size))
+            self.reference = numpy.stack((numpy.cos(phase), numpy.sin(phase)),
+                                         axis=1)
+
+        count = len(samples) // self.block_size
+        blocks = samples[:count * self.block_size].reshape(count,
+                                                           self.block_size)
+        self.leftover = samples[count * self.block_size:]
+        if count == 0:
+            return ""
+
+        # Tone power in each block.
+        parts = blocks @ self.reference
+        power = (parts * parts).sum(axis=1)
+        self._process(power)
+        self.blocks_seen += count
+        return self.decoder.take_text()
+
+    # Decode anything left at the end of the audio.
+    def finish(self):
+        if self.key_is_down:
+            self.decoder.key_up(self.blocks_seen * self.block_time)
+            self.key_is_down = False
+        return self.decoder.finish()
+
+    def _process(self, power):
+        # Measure the background noise over the last few seconds.  Only the
+        # blocks where the key was up are noise, and they're the quietest,
+        # so if (say) half the blocks were key up, the 10th percentile of
+        # them all is the 20th percentile of the noise.
+        self.history.extend(power.tolist())
+        key_up = 1.0
+        if self.key_history:
+            key_up = max(1 - sum(self.key_history) / len(self.key_history),
+                         2 * FLOOR_PERCENTILE / 100)
+        if not self.confirmed:
+            # We can't tell yet which blocks are the tone, so allow for
+            # half of them being it.
+            key_up = min(key_up, 0.5)
+        fraction = FLOOR_PERCENTILE / 100 / key_up
+        noise = max(float(numpy.percentile(self.history, FLOOR_PERCENTILE)) /
+                    -math.log(1 - fraction), 1e-12)
+        self.noise = noise
+
+        if not self.confirmed:
+            # Wait until the tone is clearly there, and ignore everything
+            # before it.
+            strong = power > MIN_SNR * noise
+            runs = strong[:len(strong) - CONFIRM_BLOCKS + 1].copy()
+            for ii in range(1, CONFIRM_BLOCKS):
+                runs &= strong[ii:len(strong) - CONFIRM_BLOCKS + 1 + ii]
+            if not runs.any():
+                self.key_history.extend([False] * len(power))
+                return
+            self.confirmed = True
+            power = power.copy()
+            power[:numpy.argmax(runs)] = 0
+
+        # Keep track of how loud the tone is, and put the threshold halfway
+        # between it and the background (on a log scale).
+        self.peak *= 0.5 ** (len(power) * self.block_time / PEAK_HALF_LIFE)
+        self.peak = max(self.peak, float(power.max()))
+        high = max(numpy.sqrt(self.peak * noise), MIN_SNR * noise)
+        low = high / HYSTERESIS
+
+        # The key goes down above high and up below low, and otherwise stays
+        # as it was: carry the last decision forward to the blocks between.
+        decided = (power > high) | (power < low)
+        last = numpy.maximum.accumulate(
+            numpy.where(decided, numpy.arange(len(power)), -1))
+        key = numpy.where(last >= 0, power[numpy.maximum(last, 0)] > high,
+                          self.raw_key)
+        self.raw_key = bool(key[-1])
+        self.key_history.extend(key.tolist())
+
+        # Ignore blips one block long: each block takes the majority vote of
+        # itself and its neighbours.  This delays everything by one block,
+        # which doesn't affect any lengths.
+        extended = numpy.concatenate((self.recent, key))
+        smoothed = (extended[:-2].astype(numpy.int8) + extended[1:-1] +
+                    extended[2:]) >= 2
+        self.recent = extended[-2:]
+
+        # Find the blocks where the key changes and pass those on.
+        previous = numpy.concatenate(([self.key_is_down], smoothed[:-1]))
+        for index in numpy.flatnonzero(smoothed != previous):
+            timestamp = (self.blocks_seen + index) * self.block_time
+            if smoothed[index]:
+                self.decoder.key_down(timestamp)
+            else:
+                self.decoder.key_up(timestamp)
+        self.key_is_down = bool(smoothed[-1])
+
+
+# Find the tone in some audio: the strongest frequency, as long as it
+# stands out clearly from the rest.  Returns None if nothing does (e.g. the
+# audio is just noise).
+def find_tone(samples, sample_rate):
+    spectrum = numpy.abs(numpy.fft.rfft(samples * numpy.hanning(len(samples))))
+    freqs = numpy.fft.rfftfreq(len(samples), 1.0 / sample_rate)
+    band = (freqs >= MIN_TONE) & (freqs <= MAX_TONE)
+    if not band.any():
+        return None
+    power = spectrum[band] ** 2
+    strongest = numpy.argmax(power)
+    if power[strongest] < TONE_PROMINENCE * numpy.median(power):
+        return None
+    return float(freqs[band][strongest])
+
+
+# Read a WAV file a chunk at a time as mono floating point samples.
+def read_wav(path, chunk_seconds=1.0):
+    with wave.open(path, "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        if width == 1:
+            dtype, offset = numpy.uint8, 128
+        elif width == 2:
+            dtype, offset = numpy.dtype("<i2"), 0
+        elif width == 4:
+            dtype, offset = numpy.dtype("<i4"), 0
+        else:
+            raise ValueError("Unsupported sample width: %d bytes" % width)
+        frames = max(1, int(rate * chunk_seconds))
+        yield rate
+        while True:
+            data = wav.readframes(frames)
+            if not data:
+                return
+            samples = numpy.frombuffer(data, dtype=dtype).astype(float)
+            samples -= offset
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            yield samples
+
+
+# Decode a WAV file, yielding the text as it's decoded.
+def decode_wav(path, tone=None, unit=TIME_UNIT, chunk_seconds=1.0):
+    chunks = read_wav(path, chunk_seconds)
+    decoder = AudioDecoder(next(chunks), tone, unit)
+    for samples in chunks:
+        text = decoder.feed(samples)
+        if text:
+            yield text
+    text = decoder.finish()
+    if text:
+        yield text
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Decode Morse code from a WAV recording.")
+    parser.add_argument("wav", help="WAV file to decode")
+    parser.add_argument("--tone", type=float, default=None,
+                        help="tone frequency in Hz (default: find it)")
+    parser.add_argument("-u", "--unit", type=float, default=TIME_UNIT,
+                        help="starting guess at the dot length, in seconds")
+    args = parser.parse_args()
+    for text in decode_wav(args.wav, args.tone, args.unit):
+        sys.stdout.write(text)
+    sys.stdout.write("\n")
+
+if __name__ == '__main__':
+    main()
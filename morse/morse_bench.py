@@ -0,0 +1,185 @@
+# morse_bench.py
+# Benchmark Wires end to end over this computer's loopback interface.
+#
+# A number of station pairs are set up on this computer, each a SERVER Wire
+# talking to a CLIENT Wire.  The client end of every pair keys a piece of
+# text at the chosen speed (with a bit of random jitter to make it more like
+# a person), and we measure:
+#
+#   - latency: how long from pressing/releasing the key at one end to the
+#     is_receiving/not_receiving callback being called at the other
+#   - accuracy: how much of the text was decoded correctly at the far end
+#   - throughput: key events delivered per second, across all pairs
+#   - cost: CPU time and memory used per station
+#
+# Usage:
+#
+#   python morse_bench.py [--pairs N] [--wpm WPM] [--jitter FRACTION]
+#                         [--text TEXT] [--port PORT]
+import argparse
+import collections
+import difflib
+import heapq
+import random
+import resource
+import threading
+import time
+from morse import Wire
+from morse_keyer import encode_text, wait_until
+from morse_protocol import KEY_DOWN
+from morse_sinks import CallbackSink
+
+DEFAULT_TEXT = "PARIS CQ CQ DE M0ABC THE QUICK BROWN FOX"
+
+
+class BenchWire(Wire):
+
+    # A Wire which keeps what it decodes instead of printing it, and times
+    # how long each key event took to arrive.
+    def __init__(self, role, port):
+        Wire.__init__(self, role=role, port=port, localip="127.0.0.1")
+        self.remoteip = "127.0.0.1"
+        self.decoded = []
+        self.latencies = []
+        # When each key event we're waiting for was sent, oldest first.  The
+        # other end of the pair adds to this as it sends.
+        self.sent_times = collections.deque()
+        self.is_receiving = self._callback
+        self.not_receiving = self._callback
+        self.sinks = [CallbackSink(self._text)]
+
+    def _callback(self):
+        now = time.monotonic()
+        if self.sent_times:
+            self.latencies.append(now - self.sent_times.popleft())
+
+    def _text(self, text, wire):
+        self.decoded.append(text)
+
+    # Check whether everything received has been decoded.
+    def finished(self):
+        return (not self.buffer and self.key_down_timestamp is None and
+                time.monotonic() - self.key_up_time > self.timing.word_gap)
+
+    def text(self):
+        return "".join(self.decoded).strip()
+
+
+# Connect up a pair of stations on the given port.
+def make_pair(port):
+    server = BenchWire(Wire.SERVER, port)
+    client = BenchWire(Wire.CLIENT, port)
+    t = threading.Thread(target=server.reconnect)
+    t.start()
+    # The client retries until the server is listening.
+    client.reconnect()
+    t.join()
+    return server, client
+
+
+# Work out when each pair should press and release its key: a list of
+# (time, pair number, state), sorted by time.  Every element and gap is
+# stretched or shrunk by up to jitter (as a fraction of its length).
+def make_schedule(text, pairs, wpm, jitter):
+    unit = 1.2 / wpm
+    events, length = encode_text(text)
+    schedules = []
+    for pair in range(pairs):
+        schedule = []
+        now = random.uniform(0, unit)
+        previous = 0
+        for when, state in events:
+            now += (when - previous) * unit * random.uniform(1 - jitter,
+                                                             1 + jitter)
+            previous = when
+            schedule.append((now, pair, state))
+        schedules.append(schedule)
+    return list(heapq.merge(*schedules)), length * unit
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, len(values) * pct // 100)]
+
+
+def rss_kib():
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(pairs, wpm, jitter, text, port):
+    rss_before = rss_kib()
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    stations = [make_pair(port + ii) for ii in range(pairs)]
+    rss_after = rss_kib()
+
+    schedule, length = make_schedule(text, pairs, wpm, jitter)
+    start = time.monotonic()
+    for when, pair, state in schedule:
+        wait_until(start + when)
+        server, client = stations[pair]
+        server.sent_times.append(time.monotonic())
+        if state == KEY_DOWN:
+            client.send_signal()
+        else:
+            client.stop_signal()
+    sent_for = time.monotonic() - start
+
+    # Give the decoders time to finish the last word.
+    deadline = time.monotonic() + 5
+    while (time.monotonic() < deadline and
+           not all(server.finished() for server, client in stations)):
+        time.sleep(0.1)
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    for server, client in stations:
+        client.close()
+        server.close()
+
+    latencies = sorted(l for s, c in stations for l in s.latencies)
+    accuracy = sum(difflib.SequenceMatcher(None, text, s.text()).ratio()
+                   for s, c in stations) / pairs
+    cpu = ((usage_after.ru_utime + usage_after.ru_stime) -
+           (usage_before.ru_utime + usage_before.ru_stime))
+    count = 2 * pairs
+
+    print("%d pairs, %d WPM, %.0f%% jitter, %.1fs of keying" %
+          (pairs, wpm, jitter * 100, sent_for))
+    print("  events delivered:   %d of %d (%.0f/s)" %
+          (len(latencies), len(schedule), len(latencies) / sent_for))
+    for pct in (50, 90, 99):
+        print("  p%d latency:        %.3f ms" %
+              (pct, 1000 * percentile(latencies, pct)))
+    print("  max latency:        %.3f ms" %
+          (1000 * (latencies[-1] if latencies else 0)))
+    print("  decode accuracy:    %.1f%%" % (100 * accuracy))
+    print("  CPU per station:    %.1f ms" % (1000 * cpu / count))
+    print("  RSS per station:    %.1f KiB" % ((rss_after - rss_before) / count))
+    if pairs == 1:
+        print("  decoded:            %s" % stations[0][0].text())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark Wires end to end over loopback.")
+    parser.add_argument("--pairs", type=int, default=1,
+                        help="number of station pairs")
+    parser.add_argument("--wpm", type=float, default=20,
+                        help="sending speed in words per minute")
+    parser.add_argument("--jitter", type=float, default=0.1,
+                        help="random timing error, as a fraction of each "
+                             "element")
+    parser.add_argument("--text", default=DEFAULT_TEXT,
+                        help="text to send")
+    parser.add_argument("--port", type=int, default=20000,
+                        help="first TCP port to use")
+    args = parser.parse_args()
+    run(args.pairs, args.wpm, args.jitter, args.text.upper(), args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# morse_decode_logs.py
+# Decode session logs recorded by a Wire (see morse_recorder.py) without
+# having to replay them in real time.
+#
+# Usage:
+#
+#   python morse_decode_logs.py [-j jobs] [-u unit] log1.mlog [log2.mlog ...]
+#
+# Each log is decoded in its own process, so a big pile of logs gets spread
+# across all the machine's cores.  For every log, the text received from
+# each peer is printed.
+import argparse
+import multiprocessing
+import sys
+from morse import TIME_UNIT
+from morse_recorder import SessionLog, LogError, decode_records
+
+
+def decode_log(args):
+    path, unit = args
+    try:
+        with SessionLog(path) as log:
+            return path, len(log), decode_records(log, unit), None
+    except (OSError, LogError) as exp:
+        return path, 0, {}, str(exp)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Decode recorded Morse code session logs.")
+    parser.add_argument("logs", nargs="+", help="session log files")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of processes to use (default: one per "
+                             "CPU)")
+    parser.add_argument("-u", "--unit", type=float, default=TIME_UNIT,
+                        help="starting guess at the dot length, in seconds")
+    args = parser.parse_args()
+
+    jobs = [(path, args.unit) for path in args.logs]
+    failed = False
+    with multiprocessing.Pool(args.jobs) as pool:
+        # Hand out one log at a time so big logs don't hold up small ones,
+        # but print the results in the order the logs were given.
+        for path, count, results, error in pool.imap(decode_log, jobs,
+                                                     chunksize=1):
+            if error is not None:
+                print("%s: %s" % (path, error), file=sys.stderr)
+                failed = True
+                continue
+            print("%s (%d events)" % (path, count))
+            for peer, text in sorted(results.items()):
+                print("  %s: %s" % (peer, text))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+# morse_discovery.py
+# Find another station on the local network automatically, so nobody has to
+# type in IP addresses.
+#
+# Each station looking for a partner broadcasts a short announcement over
+# UDP every so often, and listens for everyone else's.  An announcement
+# says who the station is, which TCP port it will use, which pairing code
+# it was given (so a class can split into pairs by agreeing codes, or just
+# use the default), and which station it would like to pair with.  Once two
+# stations have chosen each other they both lock in that choice and say so,
+# and they're paired when each has heard that the other has locked in.  That
+# way a late announcement from a station that has since changed its mind
+# can't leave someone paired on their own.
+#
+# Example:
+#
+#   w = Wire()
+#   w.connect(discover=True)
+#
+# or, to pair only with a station that was given the same code:
+#
+#   w.connect(discover=True, code="table3")
+import os
+import select
+import socket
+import struct
+import time
+
+DISCOVERY_PORT = 10001
+
+MAGIC = b"MWHI"
+VERSION = 1
+
+# magic, version, station id, TCP port, chosen station id, locked in (0 or
+# 1), code length, followed by the code.
+ANNOUNCEMENT = struct.Struct("!4sBQHQBB")
+
+# How often to announce ourselves while looking (seconds).
+ANNOUNCE_INTERVAL = 0.5
+
+
+class Discovery():
+
+    # Parms:
+    #     port      - the TCP port this station will use for its Wire.
+    #     code      - only pair with stations given the same code.
+    #     broadcast - the address to broadcast announcements to.
+    def __init__(self, port, code="", broadcast="<broadcast>"):
+        self.port = port
+        self.code = code.encode("utf-8")[:255]
+        self.broadcast = broadcast
+        # A random id, so stations on the same computer can tell each other
+        # apart.
+        self.station_id = struct.unpack("!Q", os.urandom(8))[0] or 1
+        self.chosen = 0
+        self.locked = False
+
+    def _announcement(self):
+        return ANNOUNCEMENT.pack(MAGIC, VERSION, self.station_id, self.port,
+                                 self.chosen, self.locked,
+                                 len(self.code)) + self.code
+
+    # Look for a partner.  Returns (address, port, their id) once paired, or
+    # None if nobody turned up within timeout seconds (None to wait
+    # forever).
+    def find_peer(self, timeout=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.bind(("", DISCOVERY_PORT))
+            return self._find_peer(sock, timeout)
+        finally:
+            sock.close()
+
+    def _find_peer(self, sock, timeout):
+        start = time.monotonic()
+        next_announcement = start
+        partner = None
+        while True:
+            now = time.monotonic()
+            if now >= next_announcement:
+                sock.sendto(self._announcement(),
+                            (self.broadcast, DISCOVERY_PORT))
+                next_announcement = now + ANNOUNCE_INTERVAL
+                if partner is not None:
+                    # Make sure they hear that we've locked in too before we
+                    # stop announcing.
+                    for ii in range(2):
+                        sock.sendto(self._announcement(),
+                                    (self.broadcast, DISCOVERY_PORT))
+                    return partner
+            if timeout is not None and now - start >= timeout:
+                return None
+
+            wait = next_announcement - now
+            if timeout is not None:
+                wait = min(wait, start + timeout - now)
+            ready, _, _ = select.select([sock], [], [], max(wait, 0))
+            if not ready:
+                continue
+            data, (address, _) = sock.recvfrom(1024)
+            if len(data) < ANNOUNCEMENT.size:
+                continue
+            (magic, version, their_id, their_port, their_choice,
+             their_lock, length) = ANNOUNCEMENT.unpack_from(data)
+            if (magic != MAGIC or version != VERSION or
+                    their_id == self.station_id or
+                    data[ANNOUNCEMENT.size:ANNOUNCEMENT.size + length] !=
+                    self.code):
+                continue
+
+            if self.chosen == their_id and their_choice != self.station_id:
+                if self.locked or their_choice != 0:
+                    # They've gone off with someone else.
+                    self.chosen = 0
+                    self.locked = False
+            if self.chosen == 0 and their_choice in (0, self.station_id):
+                self.chosen = their_id
+                # Tell them straight away rather than waiting for the next
+                # announcement.
+                next_announcement = now
+            if self.chosen == their_id and their_choice == self.station_id:
+                if not self.locked:
+                    self.locked = True
+                    next_announcement = now
+                if their_lock:
+                    partner = (address, their_port, their_id)
+                    next_announcement = now
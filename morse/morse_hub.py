@@ -0,0 +1,426 @@
+# morse_hub.py
+# A relay hub which lets lots of stations share a line.
+#
+# Normally two Wires connect straight to each other.  With a hub, every
+# station connects to the hub as a client instead, and the hub passes each
+# key event on to all the other stations on the same channel - so a whole
+# class (or a net of operators) can listen to whoever is sending without
+# needing a connection between every pair of stations.
+#
+# Stations pick a channel by giving one when they create their Wire:
+#
+#   w = Wire(role=Wire.CLIENT, channel="class-6b")
+#
+# Stations that don't give one all share the default channel.
+#
+# Only one station sends on a channel at a time, so that nobody hears two
+# people's keying mixed together.  Whoever presses their key first while the
+# channel is quiet has it until they've released their key for a letter gap
+# (hold); anything anyone else sends in the meantime is ignored, and counted
+# as refused.  Each station's timestamps come from its own clock, so when a
+# new station takes over a channel the hub shifts its timestamps to carry on
+# from the last station's, and everyone listening sees one steady timeline.
+#
+# Every station has its own queue of frames waiting to go out to it, so one
+# slow station can't hold up everyone else.  If a station's queue fills up,
+# frames for that station are dropped (and counted) until it catches up.
+# The newest event that didn't fit is still sent once there's room, so the
+# station's buzzer ends up in the right state, and the events skipped are
+# left as a gap in its sequence numbers so it can tell they went missing.
+#
+# To run a hub:
+#
+#   python morse_hub.py [port]
+#
+# To measure how long the hub takes to fan key events out to lots of
+# stations on this machine:
+#
+#   python morse_hub.py --bench [stations] [events]
+import asyncio
+import socket
+import struct
+import sys
+import time
+from morse import LETTER_GAP, PORT
+from morse_protocol import (FrameParser, KeyEvent, ProtocolError, HEADER,
+                            EVENT, MAGIC, MAGIC_JOIN, VERSION, encode_frame,
+                            encode_join, frame_length, KEY_DOWN, KEY_UP)
+
+DEFAULT_CHANNEL = ""
+
+# How many frames can be waiting for one station before we start dropping.
+QUEUE_SIZE = 256
+
+# How many recent fan-out latencies to keep for working out percentiles.
+LATENCY_SAMPLES = 10000
+
+SEQ = struct.Struct("!I")
+TIMESTAMP = struct.Struct("!Q")
+
+
+class Hub():
+
+    # One connected station.
+    class Station():
+
+        def __init__(self, writer, queue_size):
+            self.writer = writer
+            self.channel = DEFAULT_CHANNEL
+            self.queue = asyncio.Queue(queue_size)
+            self.dropped = 0
+            # Events dropped since the queue last had room, and the newest of
+            # them (still encoded).
+            self.lost = 0
+            self.overflow = None
+            # Frames from lots of stations get mixed together on the way out,
+            # so we number the events we send each station ourselves.
+            self.seq = 0
+            self.sender = None
+
+        # END class Station
+
+    # Who is sending on a channel.  Times are in nanoseconds, on the hub's
+    # clock except for timestamps, which are on the channel's timeline.
+    class Floor():
+
+        def __init__(self):
+            self.holder = None
+            self.key_down = False
+            self.released_at = 0
+            # What to add to the holder's timestamps to put them on the
+            # channel's timeline.
+            self.offset = 0
+            # The last timestamp sent out, and when.
+            self.last_timestamp = None
+            self.last_sent = 0
+
+        # END class Floor
+
+    # Parms:
+    #     hold - how long a station keeps the channel after releasing its key
+    #            (seconds), so that nobody else can cut in part way through
+    #            a letter.
+    def __init__(self, host="", port=PORT, queue_size=QUEUE_SIZE,
+                 hold=LETTER_GAP):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.hold = int(hold * 1e9)
+        self.server = None
+        self.channels = {}
+        self.floors = {}
+        self.frames_in = 0
+        self.frames_out = 0
+        self.dropped = 0
+        self.refused = 0
+        self.latencies = []
+        self.latency_pos = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._session, self.host,
+                                                 self.port)
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for stations in list(self.channels.values()):
+            for station in list(stations):
+                station.writer.close()
+
+    def _join(self, station, channel):
+        self._leave(station)
+        station.channel = channel
+        self.channels.setdefault(channel, set()).add(station)
+
+    def _leave(self, station):
+        self._release(station)
+        stations = self.channels.get(station.channel)
+        if stations is not None:
+            stations.discard(station)
+            if not stations:
+                del self.channels[station.channel]
+                self.floors.pop(station.channel, None)
+
+    # Let the station have its channel if it's already sending on it, or if
+    # the channel is quiet and the frame starts a new press.  Returns the
+    # channel's Floor, or None if someone else has it.
+    def _claim(self, station, frame, now):
+        floor = self.floors.setdefault(station.channel, self.Floor())
+        if floor.holder is station:
+            return floor
+        if floor.holder is not None and (floor.key_down or
+                                         now - floor.released_at < self.hold):
+            return None
+        seq, timestamp, state = EVENT.unpack_from(frame, HEADER.size)
+        if state != KEY_DOWN:
+            return None
+        floor.holder = station
+        floor.offset = 0
+        if floor.last_timestamp is not None:
+            floor.offset = (floor.last_timestamp + now - floor.last_sent -
+                            timestamp)
+        return floor
+
+    # A station has gone, or moved to another channel.  If it was in the
+    # middle of a press, end the press for everyone else so their buzzers
+    # don't stay on, and let someone else have the channel.  The press was
+    # cut short, so a gap is left in the sequence numbers before the
+    # release, and nobody decodes it.
+    def _release(self, station):
+        floor = self.floors.get(station.channel)
+        if floor is None or floor.holder is not station:
+            return
+        if floor.key_down:
+            now = time.monotonic_ns()
+            timestamp = floor.last_timestamp + now - floor.last_sent
+            frame = (HEADER.pack(MAGIC, VERSION, 1) +
+                     EVENT.pack(0, timestamp, KEY_UP))
+            self._send_out(station, frame, skip=1)
+            floor.key_down = False
+            floor.released_at = now
+            floor.last_timestamp = timestamp
+            floor.last_sent = now
+        floor.holder = None
+
+    # Look after one station until it goes away.
+    async def _session(self, reader, writer):
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        station = self.Station(writer, self.queue_size)
+        self._join(station, DEFAULT_CHANNEL)
+        station.sender = asyncio.ensure_future(self._send_to(station))
+
+        pending = bytearray()
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                pending.extend(data)
+                offset = 0
+                while True:
+                    size = frame_length(pending, offset)
+                    if size is None:
+                        break
+                    frame = bytes(pending[offset:offset + size])
+                    offset += size
+                    if frame[:2] == MAGIC:
+                        self._relay(station, frame)
+                    elif frame[:2] == MAGIC_JOIN:
+                        self._join(station,
+                                   frame[HEADER.size:].decode("utf-8"))
+                del pending[:offset]
+        except (OSError, ProtocolError, UnicodeDecodeError):
+            pass
+        finally:
+            self._leave(station)
+            station.sender.cancel()
+            writer.close()
+
+    # Pass a frame on to everyone else on the sender's channel, if it's the
+    # sender's turn.
+    def _relay(self, sender, frame):
+        self.frames_in += 1
+        now = time.monotonic_ns()
+        floor = self._claim(sender, frame, now)
+        if floor is None:
+            self.refused += 1
+            return
+
+        count = frame[3]
+        if floor.offset:
+            frame = bytearray(frame)
+            for ii in range(count):
+                offset = HEADER.size + ii * EVENT.size + SEQ.size
+                (timestamp,) = TIMESTAMP.unpack_from(frame, offset)
+                TIMESTAMP.pack_into(frame, offset, timestamp + floor.offset)
+            frame = bytes(frame)
+        seq, timestamp, state = EVENT.unpack_from(frame, len(frame) -
+                                                  EVENT.size)
+        floor.key_down = state == KEY_DOWN
+        if not floor.key_down:
+            floor.released_at = now
+        floor.last_timestamp = timestamp
+        floor.last_sent = now
+        self._send_out(sender, frame)
+
+    # Queue a frame for everyone on the sender's channel except the sender,
+    # after skipping skip sequence numbers.
+    def _send_out(self, sender, frame, skip=0):
+        now = time.monotonic()
+        for station in self.channels.get(sender.channel, ()):
+            if station is sender:
+                continue
+            try:
+                station.queue.put_nowait((now, frame, skip))
+            except asyncio.QueueFull:
+                station.dropped += 1
+                self.dropped += 1
+                station.lost += skip + frame[3]
+                station.overflow = frame[-EVENT.size:]
+
+    # Send queued frames to a station, as many at a time as are waiting.
+    async def _send_to(self, station):
+        while True:
+            batch = [await station.queue.get()]
+            while not station.queue.empty():
+                batch.append(station.queue.get_nowait())
+
+            out = bytearray()
+            for queued_at, frame, skip in batch:
+                station.seq += skip
+                frame = bytearray(frame)
+                (count,) = frame[3:4]
+                for ii in range(count):
+                    station.seq += 1
+                    SEQ.pack_into(frame, HEADER.size + ii * EVENT.size,
+                                  station.seq & 0xFFFFFFFF)
+                out += frame
+            if station.overflow is not None:
+                # Everything that was waiting has been sent, so now send the
+                # newest event that didn't fit, numbered as if the ones
+                # before it had been sent too.
+                station.seq += station.lost
+                event = bytearray(station.overflow)
+                SEQ.pack_into(event, 0, station.seq & 0xFFFFFFFF)
+                out += HEADER.pack(MAGIC, VERSION, 1) + event
+                station.lost = 0
+                station.overflow = None
+            station.writer.write(out)
+            await station.writer.drain()
+
+            now = time.monotonic()
+            for queued_at, frame, skip in batch:
+                self._record_latency(now - queued_at)
+            self.frames_out += len(batch)
+
+    def _record_latency(self, latency):
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(latency)
+        else:
+            self.latencies[self.latency_pos] = latency
+            self.latency_pos = (self.latency_pos + 1) % LATENCY_SAMPLES
+
+    # Get a summary of what the hub has been doing.  Latencies are the time
+    # from a frame arriving at the hub to it being handed to each station's
+    # connection, in seconds.
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(pct):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * pct / 100))]
+
+        return {
+            "stations": sum(len(s) for s in self.channels.values()),
+            "channels": len(self.channels),
+            "frames_in": self.frames_in,
+            "frames_out": self.frames_out,
+            "dropped": self.dropped,
+            "refused": self.refused,
+            "latency_p50": percentile(50),
+            "latency_p99": percentile(99),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
+def _print_stats(stats):
+    print("%(stations)d stations on %(channels)d channels, "
+          "%(frames_in)d frames in, %(frames_out)d out, %(dropped)d dropped, "
+          "%(refused)d refused, "
+          "latency p50 %(latency_p50).6fs p99 %(latency_p99).6fs "
+          "max %(latency_max).6fs" % stats)
+
+
+async def _run_hub(port):
+    hub = Hub(port=port)
+    await hub.start()
+    print("Hub listening on port %d" % port)
+    while True:
+        await asyncio.sleep(10)
+        _print_stats(hub.stats())
+
+
+# Connect a number of stations to a hub on this machine, have one of them
+# key a stream of events, and time how long each event takes to reach every
+# other station.  Everything runs on one machine, so the sender's monotonic
+# timestamps can be compared directly with the time each event arrives.
+async def _bench(stations, events, port):
+    hub = Hub(host="127.0.0.1", port=port)
+    await hub.start()
+
+    received = []
+
+    async def listen(reader):
+        parser = FrameParser()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            now = time.monotonic()
+            for event in parser.feed(data):
+                received.append(now - event.timestamp)
+
+    connections = []
+    listeners = []
+    for ii in range(stations):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(encode_join("bench"))
+        connections.append(writer)
+        if ii:
+            listeners.append(asyncio.ensure_future(listen(reader)))
+    await asyncio.sleep(0.2)
+
+    sender = connections[0]
+    start = time.monotonic()
+    for seq in range(1, events + 1):
+        state = KEY_DOWN if seq % 2 else KEY_UP
+        sender.write(encode_frame([KeyEvent(seq, time.monotonic(), state)]))
+        await sender.drain()
+        await asyncio.sleep(0.001)
+    expected = events * (stations - 1)
+    while len(received) < expected and time.monotonic() - start < 30:
+        await asyncio.sleep(0.05)
+
+    for writer in connections:
+        writer.close()
+    for task in listeners:
+        task.cancel()
+    # Give the hub a moment to notice everyone has gone.
+    await asyncio.sleep(0.2)
+    hub.close()
+
+    received.sort()
+    print("%d stations, %d events, %d of %d deliveries" %
+          (stations, events, len(received), expected))
+    if received:
+        for pct in (50, 90, 99):
+            print("  p%d end-to-end latency: %.6fs" %
+                  (pct, received[min(len(received) - 1,
+                                     len(received) * pct // 100)]))
+        print("  max end-to-end latency: %.6fs" % received[-1])
+    _print_stats(hub.stats())
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        stations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        events = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+        asyncio.run(_bench(stations, events, PORT))
+    else:
+        port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+        try:
+            asyncio.run(_run_hub(port))
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
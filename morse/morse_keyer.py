@@ -0,0 +1,129 @@
+# morse_keyer.py
+# An automatic keyer: give it some text and it sends it through a Wire as
+# Morse code, pressing and releasing the button for you.
+#
+# Example:
+#
+#   w = Wire()
+#   w.connect()
+#   keyer = Keyer(w, wpm=20)
+#   keyer.send("CQ CQ DE PARIS")   # Returns straight away.
+#   keyer.send("<SK>")             # Queued up behind the first message.
+#   keyer.wait()                   # Wait until both have been sent.
+#
+# Every press and release is timed against the clock from the start of the
+# message, rather than by sleeping for each dot and gap in turn.  If one
+# sleep runs a little long, the next one is shorter to make up for it, so
+# errors don't add up over a long message.
+import queue
+import re
+import threading
+import time
+from morse import TIME_UNIT
+from morse_lookup import morse_code_encode
+from morse_protocol import KEY_DOWN, KEY_UP
+
+# Sleeping isn't exact, so sleep until just before each deadline and then
+# watch the clock for the last little bit (seconds).
+SPIN_TIME = 0.001
+
+# If we fall this many units behind (e.g. the computer was busy), give up
+# trying to catch up and carry on from now instead of rushing the keying.
+MAX_LATENESS = 2
+
+# Prosigns in the text are written in angle brackets, e.g. "<SK>".
+_token = re.compile(r"<[A-Z]+>|\S|\s+")
+
+
+# Turn text into a keying schedule: a list of (time, state) pairs, where
+# time is measured in units from the start of the message.  Also returns the
+# total length of the message in units, including the gap after it.
+# Characters that have no Morse code are skipped.
+def encode_text(text):
+    schedule = []
+    now = 0
+    need_gap = 0
+    for token in _token.findall(text.upper()):
+        if token.isspace():
+            if schedule:
+                need_gap = 7
+            continue
+        code = morse_code_encode.get(token)
+        if code is None:
+            continue
+        now += need_gap
+        for ii, symbol in enumerate(code):
+            if ii:
+                now += 1
+            schedule.append((now, KEY_DOWN))
+            now += 1 if symbol == "." else 3
+            schedule.append((now, KEY_UP))
+        need_gap = 3
+    return schedule, now + 7
+
+
+class Keyer():
+
+    # Parms:
+    #     wire - the Wire (or AsyncWire) to send through.
+    #     wpm  - sending speed in words per minute.  If not given, a dot
+    #            lasts TIME_UNIT seconds.
+    def __init__(self, wire, wpm=None):
+        self.wire = wire
+        self.unit = TIME_UNIT if wpm is None else 1.2 / wpm
+        self.messages = queue.Queue()
+        self.max_lateness = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Queue a message to be sent.  Returns straight away.
+    def send(self, text):
+        self.messages.put(text)
+
+    # Wait until every queued message has been sent.
+    def wait(self):
+        self.messages.join()
+
+    # Stop once the messages already queued have been sent.
+    def stop(self):
+        self.messages.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            text = self.messages.get()
+            try:
+                if text is None:
+                    return
+                self._send(text)
+            finally:
+                self.messages.task_done()
+
+    def _send(self, text):
+        schedule, length = encode_text(text)
+        start = time.monotonic()
+        for when, state in schedule:
+            deadline = start + when * self.unit
+            lateness = wait_until(deadline)
+            self.max_lateness = max(self.max_lateness, lateness)
+            if lateness > MAX_LATENESS * self.unit:
+                # Start counting from here rather than squashing the rest of
+                # the message to catch up.
+                start += lateness
+            if state == KEY_DOWN:
+                self.wire.send_signal()
+            else:
+                self.wire.stop_signal()
+        # Leave a word gap before the next message.
+        wait_until(start + length * self.unit)
+
+
+# Wait until the monotonic clock reaches deadline.  Returns how late we were.
+def wait_until(deadline):
+    remaining = deadline - time.monotonic()
+    if remaining > SPIN_TIME:
+        time.sleep(remaining - SPIN_TIME)
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            return now - deadline
@@ -37,10 +37,115 @@ morse_code_lookup = {
     "--...":    "7",
     "---..":    "8",
     "----.":    "9",
-    "-----":    "0"
+    "-----":    "0",
+    ".-.-.-":    ".",
+    "--..--":    ",",
+    "..--..":    "?",
+    ".----.":    "'",
+    "-.-.--":    "!",
+    "-..-.":    "/",
+    "-.--.":    "(",
+    "-.--.-":    ")",
+    ".-...":    "&",
+    "---...":    ":",
+    "-.-.-.":    ";",
+    "-...-":    "=",
+    ".-.-.":    "+",
+    "-....-":    "-",
+    "..--.-":    "_",
+    ".-..-.":    '"',
+    "...-..-":    "$",
+    ".--.-.":    "@",
+    # Prosigns - procedural signals sent as one run of dots and dashes.
+    # (Some others, such as AR and BT, share their codes with + and =.)
+    "...-.-":    "<SK>",
+    "-.-.-":    "<KA>",
+    "...-.":    "<SN>",
+    "........":    "<HH>",
+    "...---...":    "<SOS>"
 }
 
+# The other way round, for sending.
+morse_code_encode = dict((letter, code)
+                         for code, letter in morse_code_lookup.items())
+
+# A decode tree, stored in a flat list.  Starting from the root (index 0), a
+# dot moves to child 2n+1 and a dash to child 2n+2, so the letter for any run
+# of dots and dashes can be found one symbol at a time, as they arrive.
+# Anything that runs off the bottom of the tree ends up at INVALID.
+MAX_DEPTH = max(len(code) for code in morse_code_lookup)
+INVALID = 2 ** (MAX_DEPTH + 1) - 1
+decode_tree = [None] * (INVALID + 1)
+for code, letter in morse_code_lookup.items():
+    node = 0
+    for symbol in code:
+        node = 2 * node + (1 if symbol == "." else 2)
+    decode_tree[node] = letter
+
+# In a stream of symbols, letters are separated by spaces and words by "/".
+LETTER_SEPARATOR = " "
+WORD_SEPARATOR = "/"
+
+
+# Move one step down the decode tree.
+def next_node(node, symbol):
+    node = 2 * node + (1 if symbol == "." else 2)
+    return node if node < INVALID else INVALID
+
+
+# Find the letter for a sequence of dots and dashes, or None if it isn't one.
+def decode_letter(symbols):
+    node = 0
+    for symbol in symbols:
+        node = next_node(node, symbol)
+    return decode_tree[node]
+
+
+# Print the letter for a sequence of dots and dashes, if it is one.  Returns
+# the letter, or None if it isn't one.
 def try_decode(bit_string):
-    if bit_string in morse_code_lookup.keys():
-        sys.stdout.write(morse_code_lookup[bit_string])
+    letter = decode_letter(bit_string)
+    if letter is not None:
+        sys.stdout.write(letter)
         sys.stdout.flush()
+    return letter
+
+
+# Lookup used for decoding whole streams: every letter plus the word
+# separator, which decodes as a space.
+_stream_lookup = dict(morse_code_lookup)
+_stream_lookup[WORD_SEPARATOR] = " "
+
+
+# Decode a whole stream of symbols, e.g. ".... .. / - .... . .-. ." gives
+# "HI THERE".  Anything that isn't a letter comes out as unknown.
+def decode_many(symbols, unknown="?"):
+    tokens = symbols.replace(WORD_SEPARATOR, " / ").split()
+    get = _stream_lookup.get
+    return "".join([get(token, unknown) for token in tokens])
+
+
+# Decode a stream of symbols that arrives in pieces, such as a large file
+# read a chunk at a time.  A letter split across two chunks is kept back
+# until the rest of it arrives.
+class StreamDecoder():
+
+    def __init__(self, unknown="?"):
+        self.unknown = unknown
+        self.partial = ""
+
+    # Decode a chunk of symbols, returning whatever text is complete.
+    def feed(self, chunk):
+        chunk = self.partial + chunk
+        # Everything after the last separator might be the start of a
+        # letter that continues in the next chunk.
+        end = max(chunk.rfind(LETTER_SEPARATOR), chunk.rfind(WORD_SEPARATOR),
+                  chunk.rfind("\n"))
+        self.partial = chunk[end + 1:]
+        return decode_many(chunk[:end + 1], self.unknown)
+
+    # Decode anything left over at the end of the stream.
+    def finish(self):
+        text = decode_many(self.partial, self.unknown)
+        self.partial = ""
+        return text
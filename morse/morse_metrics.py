@@ -0,0 +1,191 @@
+# morse_metrics.py
+# Counters and timing histograms describing what a Wire has been doing, and
+# ways of getting them out of the program.
+#
+# Every Wire has a WireStats in wire.stats, which it keeps up to date as it
+# goes.  Recording is just a few additions, so it's cheap enough to leave on
+# all the time.  To look at them:
+#
+#   print(w.stats_snapshot())
+#
+# or, to have them written out regularly:
+#
+#   exporter = JsonLinesExporter("stats.jsonl")
+#   reporter = StatsReporter({"station1": w}, [exporter], interval=10)
+#
+# An exporter is anything with an export(name, snapshot) method, so it's
+# easy to write your own to send the figures somewhere else.
+import bisect
+import json
+import threading
+import time
+
+# Histogram bucket boundaries (seconds): 10 microseconds up to about 80
+# seconds, each twice the one before.
+BUCKET_BOUNDS = [0.00001 * 2 ** ii for ii in range(24)]
+
+
+class Histogram():
+
+    # Counts how many values fell into each of a fixed set of buckets, so
+    # it takes the same small amount of memory however much is recorded.
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    # Estimate a percentile (0 to 100) from the buckets: the upper bound of
+    # the bucket it falls in.
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        wanted = self.count * pct / 100.0
+        seen = 0
+        for ii, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                if ii < len(self.bounds):
+                    return min(self.bounds[ii], self.max)
+                return self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class WireStats():
+
+    def __init__(self):
+        self.started = time.time()
+        self.events_sent = 0
+        self.events_received = 0
+        self.duplicate_events = 0
+        # Events that never arrived (spotted by gaps in their numbers).
+        self.lost_events = 0
+        # Only counted over UDP (see morse_udp.py): datagrams that turned up
+        # after a later one.
+        self.late_datagrams = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.connections = 0
+        self.letters_decoded = 0
+        self.unknown_letters = 0
+        self.max_buffer_depth = 0
+        self.errors = 0
+        self.last_error = None
+        # How long the other person held their key down for, and left it up
+        # between presses.
+        self.key_down = Histogram()
+        self.gaps = Histogram()
+        # How long from a key event arriving to our is_receiving or
+        # not_receiving callback having dealt with it.
+        self.callback_latency = Histogram()
+
+    def record_error(self, exp):
+        self.errors += 1
+        self.last_error = repr(exp)
+
+    # Get all the figures as a dictionary, ready to be turned into JSON.
+    def snapshot(self):
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "events_sent": self.events_sent,
+            "events_received": self.events_received,
+            "duplicate_events": self.duplicate_events,
+            "lost_events": self.lost_events,
+            "late_datagrams": self.late_datagrams,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "connections": self.connections,
+            "reconnects": max(self.connections - 1, 0),
+            "letters_decoded": self.letters_decoded,
+            "unknown_letters": self.unknown_letters,
+            "max_buffer_depth": self.max_buffer_depth,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "key_down": self.key_down.snapshot(),
+            "gaps": self.gaps.snapshot(),
+            "callback_latency": self.callback_latency.snapshot(),
+        }
+
+
+class JsonLinesExporter():
+
+    # Appends each snapshot to a file as one line of JSON.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, name, snapshot):
+        line = json.dumps({"wire": name, "stats": snapshot}) + "\n"
+        with self.lock:
+            with open(self.path, "a") as output:
+                output.write(line)
+
+
+class Collector():
+
+    # Keeps the latest snapshot from each wire, for other parts of the same
+    # program to look at.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = {}
+
+    def export(self, name, snapshot):
+        with self.lock:
+            self.latest[name] = snapshot
+
+    def get(self, name=None):
+        with self.lock:
+            if name is None:
+                return dict(self.latest)
+            return self.latest.get(name)
+
+
+class StatsReporter():
+
+    # Every interval seconds, takes a snapshot of each wire's stats and hands
+    # it to each exporter.  wires is a dictionary of name to Wire.
+    def __init__(self, wires, exporters, interval=10):
+        self.wires = wires
+        self.exporters = exporters
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def report(self):
+        for name, wire in list(self.wires.items()):
+            snapshot = wire.stats_snapshot()
+            for exporter in self.exporters:
+                exporter.export(name, snapshot)
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.report()
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.report()
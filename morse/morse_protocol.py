@@ -0,0 +1,152 @@
+# morse_protocol.py
+# The format of the messages two Wires send each other.
+#
+# Each message on the wire is a frame made up of a small header followed by
+# one or more key events:
+#
+#   header:  magic "MW" (2 bytes), version (1 byte), event count (1 byte)
+#   event:   sequence number (4 bytes), sender timestamp in nanoseconds
+#            (8 bytes), key state (1 byte)
+#
+# All fields are big-endian.  The timestamp comes from the sender's
+# monotonic clock, so the receiver can measure how long a key was held down
+# using the sender's timings rather than when the bytes happened to arrive.
+#
+# A station talking to a hub can also send a join frame to say which
+# channel it wants to be on:
+#
+#   header:  magic "MJ" (2 bytes), version (1 byte), name length (1 byte)
+#   body:    the channel name, UTF-8 encoded
+#
+# Over UDP (see morse_udp.py) every datagram holds exactly one frame, and
+# stations say hello to each other before sending key events:
+#
+#   header:  magic "MH" (2 bytes), version (1 byte), 0 (1 byte)
+import collections
+import struct
+
+MAGIC = b"MW"
+MAGIC_JOIN = b"MJ"
+MAGIC_HELLO = b"MH"
+VERSION = 1
+
+KEY_UP = 0
+KEY_DOWN = 1
+
+# The most events we can describe in a single frame (the count is one byte).
+MAX_EVENTS_PER_FRAME = 255
+
+HEADER = struct.Struct("!2sBB")
+EVENT = struct.Struct("!IQB")
+
+# A single key press or release.  timestamp is in seconds on the sender's
+# monotonic clock.
+KeyEvent = collections.namedtuple("KeyEvent", ["seq", "timestamp", "state"])
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# Build a frame containing the given key events.
+def encode_frame(events):
+    events = list(events)
+    if not 0 < len(events) <= MAX_EVENTS_PER_FRAME:
+        raise ValueError("A frame must hold between 1 and %d events" %
+                         MAX_EVENTS_PER_FRAME)
+    frame = bytearray(HEADER.size + len(events) * EVENT.size)
+    HEADER.pack_into(frame, 0, MAGIC, VERSION, len(events))
+    offset = HEADER.size
+    for event in events:
+        EVENT.pack_into(frame, offset,
+                        event.seq & 0xFFFFFFFF,
+                        int(event.timestamp * 1e9),
+                        event.state)
+        offset += EVENT.size
+    return bytes(frame)
+
+
+# Build a frame asking a hub to put us on the given channel.
+def encode_join(channel):
+    name = channel.encode("utf-8")
+    if len(name) > 255:
+        raise ValueError("Channel names must be at most 255 bytes long")
+    return HEADER.pack(MAGIC_JOIN, VERSION, len(name)) + name
+
+
+# Build a hello frame, for starting a UDP session.
+def encode_hello():
+    return HEADER.pack(MAGIC_HELLO, VERSION, 0)
+
+
+# Work out the size of the frame starting at offset in buffer.  Returns None
+# if there isn't enough data yet to tell, or if the frame is incomplete.
+# Raises ProtocolError if it can't be a frame at all.
+def frame_length(buffer, offset=0):
+    if len(buffer) - offset < HEADER.size:
+        return None
+    magic, version, count = HEADER.unpack_from(buffer, offset)
+    if magic == MAGIC:
+        if count == 0:
+            # encode_frame() never makes these, so it isn't a real frame.
+            raise ProtocolError("Key event frame with no events")
+        size = HEADER.size + count * EVENT.size
+    elif magic in (MAGIC_JOIN, MAGIC_HELLO):
+        size = HEADER.size + count
+    else:
+        raise ProtocolError("Bad frame magic %r" % bytes(magic))
+    if version != VERSION:
+        raise ProtocolError("Unsupported protocol version %d" % version)
+    if len(buffer) - offset < size:
+        return None
+    return size
+
+
+class FrameParser():
+
+    # Turns a stream of bytes back into key events.  Data from a socket can
+    # be fed in however it arrives - several frames at once, or a frame split
+    # across reads - and every complete frame is decoded.  Anything left over
+    # is kept until the rest of it turns up.  Join frames aren't key events;
+    # the last channel asked for is kept in self.channel.
+    def __init__(self):
+        self.pending = bytearray()
+        self.channel = None
+
+    def feed(self, data):
+        self.pending.extend(data)
+        events = []
+        offset = 0
+        view = memoryview(self.pending)
+        try:
+            while True:
+                frame_size = frame_length(view, offset)
+                if frame_size is None:
+                    break
+                with view[offset + HEADER.size:offset + frame_size] as body:
+                    magic = bytes(view[offset:offset + 2])
+                    if magic == MAGIC:
+                        for seq, timestamp, state in EVENT.iter_unpack(body):
+                            events.append(KeyEvent(seq, timestamp / 1e9,
+                                                   state))
+                    elif magic == MAGIC_JOIN:
+                        self.channel = bytes(body).decode("utf-8")
+                offset += frame_size
+        finally:
+            view.release()
+        del self.pending[:offset]
+        return events
+
+
+# Decode a datagram, which should hold a single frame.  Returns the key
+# events in it, or None if it's a hello.
+def parse_datagram(data):
+    if frame_length(data) != len(data):
+        raise ProtocolError("Datagram isn't a single frame")
+    magic = data[:2]
+    if magic == MAGIC_HELLO:
+        return None
+    if magic != MAGIC:
+        raise ProtocolError("Unexpected frame %r in a datagram" % magic)
+    return [KeyEvent(seq, timestamp / 1e9, state)
+            for seq, timestamp, state in EVENT.iter_unpack(data[HEADER.size:])]
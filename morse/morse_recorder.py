@@ -0,0 +1,152 @@
+# morse_recorder.py
+# Record everything a Wire receives to a file, and read it back later.
+#
+# A log file starts with a short header, followed by one fixed-size record
+# per key event:
+#
+#   header:  magic "MLOG" (4 bytes), version (2 bytes), record size (2 bytes)
+#   record:  sender timestamp in seconds (8-byte float), peer IPv4 address
+#            (4 bytes), key state (1 byte), padding (3 bytes)
+#
+# Everything is little-endian.  Because every record is the same size, a log
+# can be read straight out of a memory-mapped file without copying it, and
+# any record can be found without reading the ones before it.
+#
+# To record a wire's session:
+#
+#   w = Wire()
+#   w.record_to("station.mlog")
+#
+# To decode logs afterwards, see morse_decode_logs.py.
+import collections
+import mmap
+import os
+import socket
+import struct
+import threading
+from morse_protocol import KEY_DOWN
+from morse_timing import KeyDecoder
+
+MAGIC = b"MLOG"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHH")
+RECORD = struct.Struct("<dIB3x")
+
+LogRecord = collections.namedtuple("LogRecord", ["timestamp", "peer", "state"])
+
+
+class LogError(Exception):
+    pass
+
+
+class SessionRecorder():
+
+    # Appends key events to a log file, creating it if need be.
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.peers = {}
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self.records = 0
+
+    # Record one key event.  peer is the IPv4 address of the station it came
+    # from, as a string.
+    def record(self, timestamp, state, peer):
+        packed_peer = self.peers.get(peer)
+        if packed_peer is None:
+            try:
+                packed_peer = struct.unpack("!I", socket.inet_aton(peer))[0]
+            except (OSError, TypeError):
+                packed_peer = 0
+            self.peers[peer] = packed_peer
+        with self.lock:
+            self.file.write(RECORD.pack(timestamp, packed_peer, state))
+            self.records += 1
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class SessionLog():
+
+    # Reads a log file through a memory map.  Records are unpacked as they're
+    # asked for, straight from the mapped file.
+    #
+    # Example:
+    #
+    #   with SessionLog("station.mlog") as log:
+    #       for record in log:
+    #           print(record.timestamp, peer_address(record.peer),
+    #                 record.state)
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            self.file.close()
+            raise LogError("%s is too short to be a session log" % path)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise LogError("%s is not a version %d session log" %
+                           (path, VERSION))
+        # Ignore a partly-written record at the end (e.g. if the recording
+        # station crashed).
+        self.count = (size - HEADER.size) // RECORD.size
+        self.view = memoryview(self.map)[HEADER.size:
+                                         HEADER.size + self.count * RECORD.size]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("record index out of range")
+        return LogRecord(*RECORD.unpack_from(self.view, index * RECORD.size))
+
+    def __iter__(self):
+        for fields in RECORD.iter_unpack(self.view):
+            yield LogRecord(*fields)
+
+    def close(self):
+        if getattr(self, "view", None) is not None:
+            self.view.release()
+            self.view = None
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def peer_address(peer):
+    return socket.inet_ntoa(struct.pack("!I", peer))
+
+
+# Decode a sequence of LogRecords the same way a Wire would have, starting
+# from a dot length of unit seconds.  Each peer is decoded separately.
+# Returns a dictionary of peer address to decoded text.
+def decode_records(records, unit):
+    decoders = {}
+    for timestamp, peer, state in records:
+        decoder = decoders.get(peer)
+        if decoder is None:
+            decoder = decoders[peer] = KeyDecoder(unit)
+        if state == KEY_DOWN:
+            decoder.key_down(timestamp)
+        else:
+            decoder.key_up(timestamp)
+    return dict((peer_address(peer), decoder.finish())
+                for peer, decoder in decoders.items())
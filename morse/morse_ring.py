@@ -0,0 +1,114 @@
+# morse_ring.py
+# A fixed-size buffer of key presses, passed from the thread that receives
+# them to the thread that decodes them.
+#
+# Each press is kept as how long the key was down and how long it was up
+# beforehand, rather than as a dot or a dash: the decoder only decides which
+# is which when a letter ends, once it knows as much about the sender's
+# speed as it can (see morse_timing.py).
+#
+# One thread (the producer) pushes presses in as they arrive, and one other
+# thread (the consumer) takes them out a letter at a time.  Each of the two
+# counters is only ever changed by one of the threads, so they don't need a
+# lock between them: the producer writes a slot and then moves head on, and
+# the consumer only reads slots that head has already moved past.
+#
+# The buffer never grows, however long someone holds the key or however
+# noisy the line is.  When it's full, the overflow setting says what to do:
+#
+#   DROP_NEWEST - throw away presses that don't fit.
+#   DROP_OLDEST - overwrite the oldest presses.
+#
+# Either way the letter comes out as unknown, and the lost presses are
+# counted in overflows.
+import array
+import math
+from morse_lookup import MAX_DEPTH
+
+DROP_NEWEST = "drop newest"
+DROP_OLDEST = "drop oldest"
+
+# Presses the buffer holds by default.
+BUFFER_SIZE = 64
+
+
+class SymbolRing():
+
+    def __init__(self, capacity=BUFFER_SIZE, overflow=DROP_OLDEST):
+        if capacity <= MAX_DEPTH:
+            raise ValueError("capacity must be more than %d" % MAX_DEPTH)
+        if overflow not in (DROP_NEWEST, DROP_OLDEST):
+            raise ValueError("Unknown overflow setting: %r" % overflow)
+        self.capacity = capacity
+        self.overflow = overflow
+        self.gaps = array.array("d", bytes(8 * capacity))
+        self.lengths = array.array("d", bytes(8 * capacity))
+        # Total presses ever pushed and taken.  Only the producer changes
+        # head, and only the consumer changes tail.
+        self.head = 0
+        self.tail = 0
+        # Presses lost because the buffer was full, counted by whichever
+        # thread did the losing.
+        self.dropped_newest = 0
+        self.dropped_oldest = 0
+        # How many of dropped_newest the consumer has already owned up to.
+        self.reported_newest = 0
+
+    def __len__(self):
+        return min(self.head - self.tail, self.capacity)
+
+    @property
+    def overflows(self):
+        return self.dropped_newest + self.dropped_oldest
+
+    # Add a press (producer only): gap is how long the key was up before it
+    # (None if that's not known), and length how long it was down.  Returns
+    # False if it was dropped.
+    def push(self, gap, length):
+        head = self.head
+        if head - self.tail >= self.capacity and self.overflow == DROP_NEWEST:
+            self.dropped_newest += 1
+            return False
+        self.gaps[head % self.capacity] = math.nan if gap is None else gap
+        self.lengths[head % self.capacity] = length
+        self.head = head + 1
+        return True
+
+    # Take the presses up to end (a value of head; by default everything
+    # pushed so far) as one letter (consumer only).  Returns them as a list
+    # of (gap, length) pairs for TimingEstimator.split_letters() - an empty
+    # one if there weren't any - or None if some were lost.
+    def take(self, end=None):
+        if end is None:
+            end = self.head
+        start = self.tail
+        lost = False
+        if end - start > self.capacity:
+            # The oldest ones have been overwritten.
+            self.dropped_oldest += end - start - self.capacity
+            start = end - self.capacity
+            lost = True
+        self.tail = end
+        dropped_newest = self.dropped_newest
+        if dropped_newest != self.reported_newest:
+            self.reported_newest = dropped_newest
+            lost = True
+
+        gaps = self.gaps
+        lengths = self.lengths
+        capacity = self.capacity
+        presses = []
+        for index in range(start, end):
+            gap = gaps[index % capacity]
+            presses.append((None if math.isnan(gap) else gap,
+                            lengths[index % capacity]))
+        if self.head - capacity > start:
+            # The producer lapped us while we were reading.
+            lost = True
+        return None if lost else presses
+
+    # Throw away everything waiting to be decoded.  This moves tail on, so
+    # the consumer mustn't be taking at the same time.
+    def clear(self):
+        self.tail = self.head
+        self.reported_newest = self.dropped_newest
@@ -0,0 +1,165 @@
+# morse_sinks.py
+# Places for a Wire's decoded text to go.
+#
+# A wire hands each letter (and each space between words) to every sink in
+# wire.sinks.  By default that's just StdoutSink, which prints it, but it
+# can be sent anywhere instead or as well:
+#
+#   w.sinks = [CallbackSink(show_letter)]          # call a function
+#   w.sinks.append(BatchedFileSink("chat.txt"))     # keep a transcript
+#
+# A sink is anything with write(text, wire) and flush() methods.  The wire
+# is passed in so that one sink can be shared by lots of wires, e.g. a hub
+# logging what every station says.
+import asyncio
+import sys
+import threading
+import time
+
+
+class StdoutSink():
+
+    # Print the text as it's decoded.  Each piece is flushed straight away
+    # so the person watching sees every letter as it arrives.
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, text, wire):
+        # Look up sys.stdout each time, in case it's been redirected.
+        stream = self.stream or sys.stdout
+        stream.write(text)
+        stream.flush()
+
+    def flush(self):
+        pass
+
+
+class CallbackSink():
+
+    # Call callback(text, wire) with each piece of text.
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, text, wire):
+        self.callback(text, wire)
+
+    def flush(self):
+        pass
+
+
+class AsyncQueueSink():
+
+    # Put (wire, text) pairs on an asyncio.Queue, for a coroutine to pick
+    # up.  Wires decode on their own threads, so the text is handed over to
+    # the queue's event loop.  If the queue is full, text is dropped (and
+    # counted) rather than holding up the wire.
+    def __init__(self, queue, loop):
+        self.queue = queue
+        self.loop = loop
+        self.dropped = 0
+
+    def write(self, text, wire):
+        self.loop.call_soon_threadsafe(self._put, (wire, text))
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def flush(self):
+        pass
+
+
+class BatchedFileSink():
+
+    # Collect the text and write it to a file in batches: once max_size
+    # characters are waiting, or max_delay seconds after the first of them
+    # arrived, whichever comes first.
+    #
+    # If label is given, it's called with each wire to get a name for it,
+    # and each batch is written as one line per wire, "name: text".  That
+    # lets one file be shared by many wires.  Otherwise the text is written
+    # just as it was decoded.
+    def __init__(self, path, max_size=4096, max_delay=1.0, label=None):
+        self.file = open(path, "a")
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.label = label
+        self.ready = threading.Condition()
+        self.pending = {}
+        self.size = 0
+        self.due = None
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, text, wire):
+        with self.ready:
+            key = wire if self.label is not None else None
+            self.pending.setdefault(key, []).append(text)
+            self.size += len(text)
+            if self.due is None:
+                self.due = time.monotonic() + self.max_delay
+                self.ready.notify()
+            if self.size >= self.max_size:
+                self._write_pending()
+
+    def flush(self):
+        with self.ready:
+            self._write_pending()
+
+    # Write anything outstanding and close the file.
+    def close(self):
+        with self.ready:
+            self.closing = True
+            self.ready.notify()
+        self.thread.join()
+        self.file.close()
+
+    def _run(self):
+        with self.ready:
+            while not self.closing:
+                if self.due is None:
+                    self.ready.wait()
+                    continue
+                remaining = self.due - time.monotonic()
+                if remaining > 0:
+                    self.ready.wait(remaining)
+                    continue
+                self._write_pending()
+            self._write_pending()
+
+    # Called with self.ready held.
+    def _write_pending(self):
+        if not self.pending:
+            return
+        if self.label is None:
+            self.file.write("".join(self.pending[None]))
+        else:
+            self.file.write("".join("%s: %s\n" % (self.label(wire),
+                                                   "".join(pieces))
+                                    for wire, pieces in self.pending.items()))
+        self.file.flush()
+        self.pending = {}
+        self.size = 0
+        self.due = None
+
+
+class TickerSink():
+
+    # Keep the last few characters decoded, like a scrolling ticker, and
+    # call show(text) with them whenever they change.  Handy for passing
+    # text on to a display such as SevenSegment.py's, which can only show a
+    # few characters at once.
+    def __init__(self, show, length=8):
+        self.show = show
+        self.length = length
+        self.text = ""
+
+    def write(self, text, wire):
+        self.text = (self.text + text)[-self.length:]
+        self.show(self.text)
+
+    def flush(self):
+        pass
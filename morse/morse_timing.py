@@ -0,0 +1,308 @@
+# morse_timing.py
+# Works out how fast the other person is sending.
+#
+# Everything in Morse code is timed in units: a dot is one unit long, a dash
+# is three, the gap between the dots and dashes in a letter is one unit, the
+# gap between letters is three and the gap between words is seven.  Rather
+# than fixing the length of a unit up front, the TimingEstimator remembers
+# how long the last few presses lasted and splits them into two groups - the
+# short ones are dots and the long ones are dashes.  Each new press is
+# classified by whichever group it is closer to.  That way the decoder keeps
+# up with people sending anywhere from about 5 to 40+ words per minute, and
+# speeds up or slows down with them.
+#
+# Until it has heard a few presses, though, the estimator can't know the
+# speed: a lone press could be a dot or a dash, and the gaps around it could
+# be inside a letter or between letters.  So decoders keep the length of
+# every press, and the gap before it, until a letter ends, and only then
+# split them into letters (split_letters()) using everything they know by
+# then.  That way a message that starts with a dash, such as "TEST", isn't
+# decoded wrongly just because it came first.
+#
+# To check that messages are decoded from a standing start at a range of
+# speeds:
+#
+#   python morse_timing.py
+import collections
+import math
+import sys
+from morse_lookup import decode_letter
+
+DOT = "."
+DASH = "-"
+
+# Never let our idea of a unit get longer or shorter than this (seconds),
+# however strange the keying gets.  That's roughly 2 to 80 words per minute.
+MIN_UNIT = 0.015
+MAX_UNIT = 0.6
+
+# How many recent presses to split into dots and dashes.
+WINDOW = 16
+
+# If the longest recent press is less than this many times the shortest,
+# they're probably all dots or all dashes.
+MIN_SPLIT_RATIO = 2
+
+# A press shorter than a dot divided by this, or longer than a dash times
+# this, means the sender has changed speed.
+SPEED_CHANGE = 2
+
+# If our idea of a dot changes by more than this factor at once, the gap
+# estimate is started again from the new dot rather than being left to
+# catch up.
+RESEED_RATIO = 1.5
+
+
+class TimingEstimator():
+
+    # Parms:
+    #     unit      - our starting guess at the length of a dot (seconds).
+    #     smoothing - how far each new gap moves the gap estimate (0 to 1).
+    #                 Bigger numbers adapt faster but are jumpier.
+    def __init__(self, unit, smoothing=0.2):
+        self.smoothing = smoothing
+        self.dot = unit
+        self.dash = 3 * unit
+        self.element_gap = unit
+        self.last_gap = None
+        self.presses = collections.deque(maxlen=WINDOW)
+
+    # The point at which a press stops being a dot and becomes a dash.
+    # Dashes are a fixed multiple of dots whatever the speed, so this is
+    # halfway between them on a log scale.
+    @property
+    def threshold(self):
+        return math.sqrt(self.dot * self.dash)
+
+    # Our best guess at the sender's time unit, from both dots and dashes.
+    @property
+    def unit(self):
+        return (self.dot + self.dash / 3) / 2
+
+    # Speed in words per minute, using the standard word "PARIS" (50 units).
+    @property
+    def wpm(self):
+        return 1.2 / self.unit
+
+    # How long the key has to stay up before we decide a letter has ended:
+    # halfway between the gap inside a letter and the gap between letters.
+    @property
+    def letter_gap(self):
+        return 2 * max(self.unit, self.element_gap)
+
+    # How long the key has to stay up before we decide a word has ended:
+    # halfway between the gap between letters and the gap between words.
+    @property
+    def word_gap(self):
+        return 5 * max(self.unit, self.element_gap)
+
+    # The key was held down for length seconds.  Returns DOT or DASH.
+    def key_down(self, length):
+        press = min(max(length, MIN_UNIT), 3 * MAX_UNIT)
+        if (press < self.dot / SPEED_CHANGE or
+                press > self.dash * SPEED_CHANGE):
+            return self._restart(press)
+        self.presses.append(press)
+        self._split()
+        return DOT if length < self.threshold else DASH
+
+    # The key was up for length seconds between two presses.  Only the gaps
+    # inside a letter tell us much about the sender's timing - longer ones
+    # depend on how long they stopped to think.
+    def key_up(self, length):
+        self.last_gap = length
+        if length < 2 * self.unit:
+            self.element_gap += self.smoothing * (length - self.element_gap)
+            self.element_gap = min(max(self.element_gap, MIN_UNIT), MAX_UNIT)
+
+    # Split the recent presses into dots and dashes, choosing the split that
+    # keeps each group as tight as possible (on a log scale, so a fast
+    # sender's dashes and a slow sender's dots are treated alike).
+    def _split(self):
+        logs = sorted(math.log(press) for press in self.presses)
+        if logs[-1] - logs[0] < math.log(MIN_SPLIT_RATIO):
+            # Everything recent looks the same.  If the key was only up for a
+            # fraction of a press just now, that was the gap inside a letter,
+            # so they're dashes.  Otherwise work out whether it's a run of
+            # dots or of dashes from whichever we were expecting it to be
+            # closer to.  Either way, scale the other to match.
+            mean = math.exp(sum(logs) / len(logs))
+            if self.last_gap is not None and self.last_gap < mean / 2:
+                self._set(mean / 3, mean)
+            elif (abs(math.log(mean / self.dot)) <
+                  abs(math.log(mean / self.dash))):
+                self._set(mean, 3 * mean)
+            else:
+                self._set(mean / 3, mean)
+            return
+
+        total = sum(logs)
+        best_split = 1
+        best_score = None
+        below = 0
+        for ii in range(1, len(logs)):
+            below += logs[ii - 1]
+            above = total - below
+            # Between-group variance (times a constant) - the bigger this is,
+            # the tighter each group is.
+            score = (below * below / ii +
+                     above * above / (len(logs) - ii))
+            if best_score is None or score > best_score:
+                best_score = score
+                best_split = ii
+        dots = logs[:best_split]
+        dashes = logs[best_split:]
+        self._set(math.exp(sum(dots) / len(dots)),
+                  math.exp(sum(dashes) / len(dashes)))
+
+    # The sender has changed speed, so what we learned from their recent
+    # presses no longer helps: start again from this one.  On its own it
+    # could be a dot or a dash.  If the key was only up for a fraction of
+    # the press beforehand, that was probably the gap inside a letter, so
+    # the press is a dash; otherwise guess a dot, which is what most letters
+    # start with.
+    def _restart(self, press):
+        self.presses.clear()
+        self.presses.append(press)
+        if self.last_gap is not None and self.last_gap < press / 2:
+            self._set(press / 3, press)
+            return DASH
+        self._set(press, 3 * press)
+        return DOT
+
+    # Split a run of presses into letters, with what we know now.  presses
+    # is a list of (gap, length) pairs: how long the key was up before each
+    # press (None if that's not known) and how long it was down.  The gap
+    # before the first press is ignored, as the letter boundary there has
+    # already been dealt with.  Returns a list of letters, each a string of
+    # dots and dashes, with " " between words.
+    def split_letters(self, presses):
+        threshold = self.threshold
+        letter_gap = self.letter_gap
+        word_gap = self.word_gap
+        letters = []
+        symbols = []
+        for gap, length in presses:
+            if symbols and gap is not None and gap >= letter_gap:
+                letters.append("".join(symbols))
+                symbols = []
+                if gap >= word_gap:
+                    letters.append(" ")
+            symbols.append(DOT if length < threshold else DASH)
+        if symbols:
+            letters.append("".join(symbols))
+        return letters
+
+    def _set(self, dot, dash):
+        old_dot = self.dot
+        self.dot = min(max(dot, MIN_UNIT), MAX_UNIT)
+        self.dash = min(max(dash, 2 * self.dot), 4.5 * self.dot)
+        # Keep the gap estimate in step with the dots: the gap inside a
+        # letter is a unit long, so it's never far from a dot.
+        if max(self.dot / old_dot, old_dot / self.dot) > RESEED_RATIO:
+            self.element_gap = self.dot
+        self.element_gap = min(max(self.element_gap, self.dot / 2),
+                               2 * self.dot)
+
+
+class KeyDecoder():
+
+    # Turns a run of key presses and releases into text, the same way a Wire
+    # does: the sender's speed is learned as we go, and letters and words end
+    # when the key stays up for longer than the letter and word gaps.  Use it
+    # for keying that doesn't come over a wire, such as recorded logs or
+    # audio.  Times are in seconds, from any clock.
+    #
+    # Example:
+    #
+    #   decoder = KeyDecoder(TIME_UNIT)
+    #   decoder.key_down(0.0)
+    #   decoder.key_up(0.2)
+    #   ...
+    #   text = decoder.finish()
+    def __init__(self, unit):
+        self.timing = TimingEstimator(unit)
+        self.down_at = None
+        self.up_at = None
+        self.gap = None
+        # (gap, length) of each press since the last letter boundary (see
+        # TimingEstimator.split_letters()).
+        self.presses = []
+        self.text = []
+
+    def key_down(self, timestamp):
+        self.gap = None
+        if self.up_at is not None:
+            gap = timestamp - self.up_at
+            if gap >= self.timing.word_gap:
+                self._end_letter()
+                self.text.append(" ")
+            elif gap >= self.timing.letter_gap:
+                self._end_letter()
+            self.timing.key_up(gap)
+            self.gap = gap
+        self.down_at = timestamp
+
+    def key_up(self, timestamp):
+        if self.down_at is not None:
+            length = timestamp - self.down_at
+            self.timing.key_down(length)
+            self.presses.append((self.gap, length))
+            self.down_at = None
+            self.up_at = timestamp
+
+    # Get the text decoded since the last call.
+    def take_text(self):
+        text = "".join(self.text)
+        self.text = []
+        return text
+
+    # Decode whatever is left at the end of the keying, and get the text
+    # decoded since the last call.
+    def finish(self):
+        self._end_letter()
+        return self.take_text()
+
+    def _end_letter(self):
+        for symbols in self.timing.split_letters(self.presses):
+            letter = " " if symbols == " " else decode_letter(symbols)
+            if letter is not None:
+                self.text.append(letter)
+        self.presses = []
+
+
+# Messages for main() to check, starting with dashes as well as with dots.
+CHECK_MESSAGES = ["TEST TEST", "MORSE CODE", "CQ CQ", "73", "MO", "0",
+                  "PARIS", "SOS", "HELLO WORLD"]
+CHECK_SPEEDS = [5, 8, 12, 15, 20, 25, 30, 40]
+
+
+# Decode each of the check messages, keyed perfectly, with a new
+# KeyDecoder each time, and report any that come out wrong.
+def main():
+    from morse import TIME_UNIT
+    from morse_keyer import encode_text
+    from morse_protocol import KEY_DOWN
+
+    failed = 0
+    for text in CHECK_MESSAGES:
+        for wpm in CHECK_SPEEDS:
+            unit = 1.2 / wpm
+            decoder = KeyDecoder(TIME_UNIT)
+            schedule, length = encode_text(text)
+            for when, state in schedule:
+                if state == KEY_DOWN:
+                    decoder.key_down(when * unit)
+                else:
+                    decoder.key_up(when * unit)
+            decoded = decoder.finish()
+            if decoded != text:
+                print("%s at %d WPM decoded as %s" % (text, wpm, decoded))
+                failed += 1
+    print("%d of %d decoded correctly" %
+          (len(CHECK_MESSAGES) * len(CHECK_SPEEDS) - failed,
+           len(CHECK_MESSAGES) * len(CHECK_SPEEDS)))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# morse_udp.py
+# A Wire that talks over UDP instead of TCP, for when the network is a bit
+# unreliable (e.g. a busy classroom Wi-Fi).
+#
+# With TCP, one lost packet holds up everything after it until it has been
+# sent again, so a dot can arrive as a long press, or a release can arrive
+# so late that it sounds like a dash.  With UDP each message stands on its
+# own: a lost one is just lost, and the next one still arrives on time.  To
+# make up for that:
+#
+#   - every datagram carries the last few key events, not just the newest,
+#     so one lost datagram doesn't lose anything; and
+#   - the latest datagram is sent again a few times shortly afterwards, so
+#     if the last release of a message is lost the other end's buzzer
+#     doesn't stay on.
+#
+# Events carry sequence numbers and the sender's timestamps as they do over
+# TCP, so repeats are ignored, and lost events and late datagrams are
+# counted in the wire's stats (lost_events and late_datagrams; see
+# morse_metrics.py).
+#
+# Use it just like a Wire - both ends need to use UdpWire:
+#
+#   w = UdpWire()
+#   w.connect()
+import collections
+import select
+import socket
+import threading
+import time
+from morse import *
+from morse_protocol import (ProtocolError, encode_frame, encode_hello,
+                            parse_datagram)
+
+# How many of the latest key events to send in every datagram.
+REDUNDANCY = 4
+
+# How long after each key event to send the latest datagram again
+# (seconds).
+RESEND_DELAYS = (0.01, 0.03, 0.1, 0.3)
+
+
+class UdpWire(Wire):
+
+    # Parms as for Wire, except that UdpWire can't use a hub, plus:
+    #     redundancy - how many of the latest key events to send in every
+    #                  datagram.
+    def __init__(self, role=Wire.UNSPECIFIED, port=PORT, localip=None,
+                 interface=None, redundancy=REDUNDANCY, **kwargs):
+        Wire.__init__(self, role, port, localip=localip, interface=interface,
+                      **kwargs)
+        self.history = collections.deque(maxlen=redundancy)
+        self.resend_ready = threading.Condition()
+        self.resend_at = collections.deque()
+        self.closing = False
+        # A pair of connected sockets: close() writes to waker to wake the
+        # listener, which is waiting on wakeup as well as its own socket.
+        self.wakeup = self.waker = None
+
+    def reconnect(self):
+        if not self.connected:
+            self._join_threads()
+            self.closing = False
+            if self.role == self.SERVER:
+                self.start_server()
+            else:
+                self.start_client()
+
+            self.stats.connections += 1
+            self.listening = True
+            self._reset_receiver()
+            self.wakeup, self.waker = socket.socketpair()
+            self.threads = [threading.Thread(target=target, args=())
+                            for target in (self.decoder_thread,
+                                           self.listen_for_signal,
+                                           self._resend_thread)]
+            for thread in self.threads:
+                thread.start()
+
+    # Stop listening and sending, and wait for the threads to finish.
+    def close(self):
+        self.closing = True
+        with self.resend_ready:
+            self.resend_ready.notify()
+        if self.waker is not None:
+            try:
+                self.waker.send(b"\0")
+            except OSError:
+                # The listener has already stopped.
+                pass
+        self._join_threads()
+
+    # Wait for the other end to say hello, and answer it.
+    def start_server(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.localip, self.port))
+        print("Waiting for the other end to connect")
+        while True:
+            data, address = self.sock.recvfrom(1024)
+            try:
+                if parse_datagram(data) is None:
+                    break
+            except ProtocolError:
+                pass
+        # Only listen to them from now on.
+        self.sock.connect(address)
+        self.sock.send(encode_hello())
+        self.connection = self.sock
+        self.peer = address[0]
+        print("Connected!\n\n  PRESS CTRL-C TO STOP THE PROGRAM\n\n")
+        self.connected = True
+
+    # Say hello to the other end until it answers - quickly at first, then
+    # less often.
+    def start_client(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((self.remoteip, self.port))
+        print("Connecting to the other end...")
+        delay = 0.1
+        while not self.connected:
+            try:
+                self.sock.send(encode_hello())
+                ready, _, _ = select.select([self.sock], [], [], delay)
+                if ready and parse_datagram(self.sock.recv(1024)) is None:
+                    self.connected = True
+                    break
+            except ConnectionRefusedError:
+                # Nobody's listening yet.
+                time.sleep(delay)
+            except ProtocolError:
+                pass
+            if delay >= 1:
+                print("...waiting for the other end to start up...")
+            delay = min(delay * 2, 5)
+
+        print("Connected!\n\n  PRESS CTRL-C TO STOP THE PROGRAM\n\n")
+        self.connection = self.sock
+        self.peer = self.remoteip
+
+    # Send the event along with the few before it, and arrange for the
+    # latest datagram to be sent again in case it gets lost.
+    def _send_event(self, event):
+        with self.resend_ready:
+            self.history.append(event)
+            frame = encode_frame(self.history)
+            self._send_frame(frame)
+            self.stats.events_sent += 1
+            self.stats.bytes_sent += len(frame)
+            now = time.monotonic()
+            self.resend_at.clear()
+            self.resend_at.extend(now + delay for delay in RESEND_DELAYS)
+            self.resend_ready.notify()
+
+    def _send_frame(self, frame):
+        try:
+            self.sock.send(frame)
+        except OSError as exp:
+            # The other end may just not be there for a moment; we'll send
+            # everything again with the next event anyway.
+            self.stats.record_error(exp)
+
+    def _resend_thread(self):
+        with self.resend_ready:
+            while not self.closing and self.connected:
+                if not self.resend_at:
+                    # _send_event(), close() and the listener stopping all
+                    # wake us.
+                    self.resend_ready.wait()
+                    continue
+                remaining = self.resend_at[0] - time.monotonic()
+                if remaining > 0:
+                    self.resend_ready.wait(remaining)
+                    continue
+                self.resend_at.popleft()
+                frame = encode_frame(self.history)
+                self._send_frame(frame)
+                self.stats.bytes_sent += len(frame)
+
+    def listen_for_signal(self):
+        received_a_signal = False
+        try:
+            while not self.closing:
+                ready, _, _ = select.select([self.sock, self.wakeup], [], [])
+                if self.wakeup in ready:
+                    # We've been closed.
+                    break
+                try:
+                    data = self.sock.recv(1024)
+                except ConnectionRefusedError:
+                    # The other end isn't there at the moment.
+                    continue
+                received_at = time.monotonic()
+                self.stats.bytes_received += len(data)
+                try:
+                    events = parse_datagram(data)
+                except ProtocolError as exp:
+                    self.stats.record_error(exp)
+                    continue
+                if events is None:
+                    # They didn't hear our answer to their hello.
+                    if self.role == self.SERVER:
+                        self._send_frame(encode_hello())
+                    continue
+                if not received_a_signal:
+                    print("Receiving OK")
+                    received_a_signal = True
+                self._check_sequence(events)
+                self._receive_events(events, received_at)
+        except OSError as exp:
+            self.stats.record_error(exp)
+            print("Lost the connection: %s" % exp)
+        finally:
+            self.connected = False
+            self.sock.close()
+            self.wakeup.close()
+            self.waker.close()
+            if self.recorder is not None:
+                self.recorder.flush()
+            with self.decode_ready:
+                self._cut_off()
+                self.listening = False
+                self.decode_ready.notify()
+            with self.resend_ready:
+                self.resend_ready.notify()
+
+    # Count datagrams that arrive out of order.  (Repeats of the latest
+    # datagram are expected, so they don't count as late.  Events lost even
+    # with the redundancy are counted by _receive_events().)
+    def _check_sequence(self, events):
+        if events and events[-1].seq < self.last_seq:
+            self.stats.late_datagrams += 1